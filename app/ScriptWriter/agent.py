@@ -1,44 +1,156 @@
+import copy
+import functools
 import os
+import sys
+import msgspec
 from google.adk.agents import Agent
-from pydantic import BaseModel, Field
-from typing import List
-from dotenv import load_dotenv
+from pydantic import BaseModel, ConfigDict
+from typing import Final, List
+from google.genai import types
+from common.env import bootstrap
+from common.ratelimit import RateLimitedGemini
 
+from .cache import CORRECTION_PREFIX, ScriptCache
 
 
-load_dotenv()
 
+bootstrap()
+
+# Run full Pydantic validation on the LLM output only when debugging
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")
 
 # --- Define Output Schema ---
+# Build validators eagerly and make instances immutable (no assignment checks)
+SCHEMA_CONFIG = ConfigDict(
+    defer_build=False, frozen=True, extra="ignore", validate_assignment=False
+)
+
+# Field descriptions only matter to the LLM, so they live in the JSON schema
+# instead of per-field FieldInfo metadata on the validators
+SCRIPT_LINE_DESCRIPTIONS = {
+    "sec": "The second number in the video timeline, starting from 1 up to video duration.",
+    "scene": "A detailed description of the video scene for this second. Must repeat the core context so each second is self-contained.",
+    "dialog": "Short spoken text (character line or narration). Only used for voice.",
+    "non_dialog": "Non-verbal audio cues (music, ambient sound, sound effects).",
+    "gender": "The speaker’s gender if there is dialog ('male', 'female', 'neutral'), or 'none' if no speaker.",
+}
+
+SCRIPT_OUTPUT_DESCRIPTIONS = {
+    "script": "A list of scene/dialog pairs, one for each second of the video.",
+}
+
+
+def describe_properties(descriptions: dict):
+    """Build a json_schema_extra hook that adds descriptions to schema properties"""
+
+    def add_descriptions(schema: dict) -> None:
+        for name, description in descriptions.items():
+            schema["properties"][name]["description"] = description
+
+    return add_descriptions
+
+
 class ScriptLine(BaseModel):
-    sec: int = Field(
-        description="The second number in the video timeline, starting from 1 up to video duration."
-    )
-    scene: str = Field(
-        description="A detailed description of the video scene for this second. Must repeat the core context so each second is self-contained."
-    )
-    dialog: str = Field(
-        description="Short spoken text (character line or narration). Only used for voice."
-    )
-    non_dialog: str = Field(
-        description="Non-verbal audio cues (music, ambient sound, sound effects)."
-    )
-    gender: str = Field(
-        description="The speaker’s gender if there is dialog ('male', 'female', 'neutral'), or 'none' if no speaker."
+    model_config = ConfigDict(
+        **SCHEMA_CONFIG, json_schema_extra=describe_properties(SCRIPT_LINE_DESCRIPTIONS)
     )
 
+    sec: int
+    scene: str
+    dialog: str
+    non_dialog: str
+    gender: str
+
+
+
+# --- Decoding Records ---
+# Pydantic models above stay the schema sent to Gemini (ADK requires a BaseModel);
+# responses are decoded with these msgspec structs, which is much faster.
+class ScriptLineRecord(msgspec.Struct):
+    sec: int
+    scene: str
+    dialog: str
+    non_dialog: str
+    gender: str
+
+
+class ScriptOutputRecord(msgspec.Struct):
+    script: List[ScriptLineRecord]
 
 
 class ScriptOutput(BaseModel):
-    script: List[ScriptLine] = Field(
-        description="A list of scene/dialog pairs, one for each second of the video."
+    model_config = ConfigDict(
+        **SCHEMA_CONFIG, json_schema_extra=describe_properties(SCRIPT_OUTPUT_DESCRIPTIONS)
     )
 
+    script: List[ScriptLine]
+
+    @classmethod
+    def from_llm(cls, raw) -> "ScriptOutput":
+        """
+        Build a ScriptOutput from trusted structured LLM output without Pydantic validation.
+
+        Args:
+            raw: JSON response (str or bytes) containing a "script" list
+
+        Returns:
+            ScriptOutput instance built with model_construct
+        """
+        record = msgspec.json.decode(raw, type=ScriptOutputRecord)
+        return cls.model_construct(
+            script=[
+                ScriptLine.model_construct(
+                    sec=line.sec,
+                    scene=line.scene,
+                    dialog=line.dialog,
+                    non_dialog=line.non_dialog,
+                    gender=line.gender,
+                )
+                for line in record.script
+            ]
+        )
+
+    @classmethod
+    def model_validate_json(cls, json_data, *, strict=None, context=None, **kwargs):
+        """ADK parses the agent output through here; skip validation unless DEBUG is set."""
+        if DEBUG:
+            return super().model_validate_json(
+                json_data, strict=strict, context=context, **kwargs
+            )
+        return cls.from_llm(json_data)
+
+    @classmethod
+    def model_json_schema(cls, *args, **kwargs):
+        """The response schema is converted on every Gemini request; serve it from cache."""
+        if args or kwargs:
+            return super().model_json_schema(*args, **kwargs)
+        # Callers may mutate the schema while converting it, so hand out a copy
+        return copy.deepcopy(get_schema())
+
+
+@functools.lru_cache(maxsize=1)
+def get_schema() -> dict:
+    """Build the ScriptOutput JSON schema once per process."""
+    return super(ScriptOutput, ScriptOutput).model_json_schema()
+
+
+SCRIPT_OUTPUT_SCHEMA = get_schema()
+
+# Make sure both models are fully built before the first request
+for _model in (ScriptLine, ScriptOutput):
+    _model.model_rebuild()
+    _ = _model.__pydantic_validator__
+
+
+# Fixed-schema script writing is a low-reasoning task, so default to the Lite tier
+MODEL = os.getenv("SCRIPTWRITER_MODEL", "gemini-2.0-flash-lite")
+TEMPERATURE = float(os.getenv("SCRIPTWRITER_TEMPERATURE", 0.2))
+
 
 # --- Define System Prompt ---
-video_duration = int(os.getenv("VIDEO_DURATION", 30))  # Total duration of the video in seconds
+video_duration = bootstrap()["VIDEO_DURATION"]  # Total duration of the video in seconds
 
-systemPrompt = f"""
+SYSTEM_PROMPT_TEMPLATE = """
 You are a Script Agent.
 Your task is to break down any given scene idea into a {video_duration}-second script.
 The output must always be in JSON list format, containing exactly {video_duration} items (one for each second).
@@ -61,14 +173,82 @@ Rules:
 Return ONLY the JSON list as the output, without any extra explanation.
 """
 
+# Prompts for the usual video lengths are formatted and interned once, so each
+# duration maps to a single string
+_PROMPT_CACHE = {
+    duration: sys.intern(SYSTEM_PROMPT_TEMPLATE.format(video_duration=duration))
+    for duration in (15, 30, 60, 90)
+}
+
+
+def get_system_prompt(duration: int) -> str:
+    """Get the system prompt for a video duration, formatting it on first use"""
+    prompt = _PROMPT_CACHE.get(duration)
+    if prompt is None:
+        prompt = _PROMPT_CACHE[duration] = sys.intern(
+            SYSTEM_PROMPT_TEMPLATE.format(video_duration=duration)
+        )
+    return prompt
+
+
+# Interned so every agent instance and cache key shares one string object
+SCRIPT_WRITER_SYSTEM_PROMPT: Final[str] = get_system_prompt(video_duration)
+systemPrompt = SCRIPT_WRITER_SYSTEM_PROMPT
+
+
+def check_script(script) -> bool:
+    """
+    Single-pass check of the script contract: exactly video_duration lines with sec 1..N.
+
+    Args:
+        script: Script lines as models, msgspec records or dicts
+
+    Returns:
+        bool: True if the script is complete and in order
+    """
+    if len(script) != video_duration:
+        return False
+    for expected, line in enumerate(script, 1):
+        sec = line["sec"] if isinstance(line, dict) else line.sec
+        if sec != expected:
+            return False
+    return True
+
+
+def correction_prompt() -> str:
+    """Follow-up asking the model to fix a script that broke the contract"""
+    return (
+        f"{CORRECTION_PREFIX} Rewrite it with exactly {video_duration} items, "
+        f"with \"sec\" numbered from 1 to {video_duration}."
+    )
+
+
+def is_complete_response(raw) -> bool:
+    """Check that a raw model response decodes to a complete script"""
+    try:
+        return check_script(msgspec.json.decode(raw, type=ScriptOutputRecord).script)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return False
+
+
+# Answer repeated scene ideas from the local cache
+script_cache = ScriptCache(systemPrompt, video_duration, validate=is_complete_response)
+
+
+async def before_model(callback_context, llm_request):
+    """Serve cached scripts and skip the model call on a hit"""
+    return await script_cache.lookup(callback_context, llm_request)
 
 
 # --- Create Script Writer Agent ---
 root_agent = Agent(
     name="script_writer",
-    model="gemini-2.0-flash-exp",
+    model=RateLimitedGemini(model=MODEL),
     description="Agent to write structured second-by-second video scripts for AI video generation models.",
     instruction=systemPrompt,
     output_schema=ScriptOutput,
     output_key="script",
+    generate_content_config=types.GenerateContentConfig(temperature=TEMPERATURE),
+    before_model_callback=before_model,
+    after_model_callback=script_cache.store,
 )
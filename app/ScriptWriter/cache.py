@@ -0,0 +1,143 @@
+"""
+Local response cache for the script writer agent.
+
+Repeated scene ideas are answered from disk instead of another Gemini round-trip.
+With SCRIPTWRITER_SEMANTIC_CACHE enabled, near-duplicate ideas are also answered
+from an in-memory embedding index.
+"""
+
+import asyncio
+import functools
+import hashlib
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+import diskcache
+from common.semantic_cache import SemanticCache, semantic_cache_available
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+
+@functools.cache
+def get_cache() -> diskcache.Cache:
+    """Open the on-disk cache, sized and located from the environment."""
+    return diskcache.Cache(
+        os.getenv("SCRIPTWRITER_CACHE_DIR", ".cache/scriptwriter"),
+        size_limit=int(os.getenv("SCRIPTWRITER_CACHE_SIZE_LIMIT", 256 * 1024 * 1024)),
+    )
+
+
+# Corrective follow-ups start with this; they are cached under the idea they correct
+CORRECTION_PREFIX = "Your previous script did not follow the format."
+
+
+def _scene_idea(llm_request: LlmRequest) -> Tuple[str, bool]:
+    """
+    Return the scene idea a request answers and whether it is a correction.
+
+    A corrective follow-up reads the same for every topic, so it is resolved to
+    the user message before it.
+    """
+    texts = (
+        "".join(part.text or "" for part in content.parts)
+        for content in reversed(llm_request.contents or [])
+        if content.role == "user" and content.parts
+    )
+    text = next(texts, "")
+    if not text.startswith(CORRECTION_PREFIX):
+        return text, False
+    for previous in texts:
+        if not previous.startswith(CORRECTION_PREFIX):
+            return previous, True
+    return "", True
+
+
+class ScriptCache:
+    """Caches script_writer responses keyed on prompt, scene idea and duration"""
+
+    def __init__(
+        self,
+        system_prompt: str,
+        video_duration: int,
+        validate: Optional[Callable[[str], bool]] = None,
+    ):
+        self.system_prompt = system_prompt
+        self.video_duration = video_duration
+        # Responses failing this check are not cached
+        self.validate = validate
+        self.ttl = int(os.getenv("SCRIPTWRITER_CACHE_TTL", 7 * 24 * 3600))
+        # The prompt prefix of every key is hashed once and the hasher state reused
+        self._key_prefix = hashlib.blake2b(f"{system_prompt}|".encode())
+        # Cache keys and user messages of in-flight model calls, by invocation id;
+        # the message is None for corrections, which stay out of the semantic cache
+        self._pending: Dict[str, Tuple[str, Optional[str]]] = {}
+        self.semantic = self._create_semantic_cache()
+
+    @staticmethod
+    def _create_semantic_cache() -> Optional[SemanticCache]:
+        """Create the near-duplicate cache when enabled and its dependencies exist"""
+        if os.getenv("SCRIPTWRITER_SEMANTIC_CACHE", "").lower() not in ("1", "true", "yes"):
+            return None
+        if not semantic_cache_available():
+            print("Semantic cache disabled: sentence-transformers/faiss not installed")
+            return None
+        return SemanticCache(
+            threshold=float(os.getenv("SCRIPTWRITER_SEMANTIC_THRESHOLD", 0.92))
+        )
+
+    def make_key(self, user_message: str, correction: bool = False) -> str:
+        """Build the cache key for a scene idea, or for the correction of its script"""
+        hasher = self._key_prefix.copy()
+        hasher.update(f"{user_message}|{self.video_duration}".encode())
+        if correction:
+            hasher.update(b"|correction")
+        return hasher.hexdigest()
+
+    async def lookup(
+        self, callback_context: CallbackContext, llm_request: LlmRequest
+    ) -> Optional[LlmResponse]:
+        """before_model_callback: answer from cache and skip the model on a hit"""
+        user_message, correction = _scene_idea(llm_request)
+        if not user_message:
+            return None
+
+        key = self.make_key(user_message, correction)
+        cached = get_cache().get(key)
+        if correction:
+            user_message = None
+        elif cached is None and self.semantic:
+            # Loading the model and encoding would stall every session on the loop
+            cached = await asyncio.to_thread(self.semantic.lookup, user_message)
+            if cached is not None:
+                print(f"Script semantic cache hit: {user_message[:50]}")
+        elif cached is not None:
+            print(f"Script cache hit: {key[:16]}")
+
+        if cached is None:
+            self._pending[callback_context.invocation_id] = (key, user_message)
+            return None
+
+        return LlmResponse(
+            content=types.Content(role="model", parts=[types.Part(text=cached)])
+        )
+
+    async def store(
+        self, callback_context: CallbackContext, llm_response: LlmResponse
+    ) -> Optional[LlmResponse]:
+        """after_model_callback: save the final response for the pending key"""
+        if llm_response.partial:
+            return None
+
+        pending = self._pending.pop(callback_context.invocation_id, None)
+        parts = llm_response.content and llm_response.content.parts
+        if not (pending and parts and parts[0].text):
+            return None
+        if self.validate and not self.validate(parts[0].text):
+            return None
+
+        key, user_message = pending
+        get_cache().set(key, parts[0].text, expire=self.ttl)
+        if self.semantic and user_message is not None:
+            await asyncio.to_thread(self.semantic.add, user_message, parts[0].text)
+        return None
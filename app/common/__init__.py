@@ -0,0 +1 @@
+# Shared helpers for the agents and the web app
@@ -0,0 +1,20 @@
+"""
+Process-wide environment bootstrap.
+"""
+
+import functools
+import os
+
+from dotenv import load_dotenv
+
+
+@functools.cache
+def bootstrap() -> dict:
+    """
+    Load the .env file once per process and read the shared settings.
+
+    Returns:
+        dict: Settings shared by the agents and the web app
+    """
+    load_dotenv()
+    return {"VIDEO_DURATION": int(os.getenv("VIDEO_DURATION", "30"))}
@@ -0,0 +1,68 @@
+"""
+Client-side rate limiting for Gemini calls.
+
+Requests are shaped by shared token buckets sized from GEMINI_RPM and GEMINI_TPM
+(defaults match the paid tier), so bursts wait locally instead of failing with 429.
+"""
+
+import contextlib
+import functools
+import os
+from typing import AsyncGenerator
+
+from aiolimiter import AsyncLimiter
+from google.adk.models import Gemini, LlmRequest, LlmResponse
+
+
+def _per_second_limiter(per_minute: float) -> AsyncLimiter:
+    """Spread a per-minute budget over one-second buckets"""
+    if per_minute >= 60:
+        return AsyncLimiter(max_rate=per_minute / 60, time_period=1)
+    # Budgets below one per second release a single slot at a time
+    return AsyncLimiter(max_rate=1, time_period=60 / per_minute)
+
+
+@functools.cache
+def get_request_limiter() -> AsyncLimiter:
+    """Shared requests-per-minute limiter"""
+    return _per_second_limiter(float(os.getenv("GEMINI_RPM", 1800)))
+
+
+@functools.cache
+def get_token_limiter() -> AsyncLimiter:
+    """Shared tokens-per-minute limiter"""
+    return _per_second_limiter(float(os.getenv("GEMINI_TPM", 3_500_000)))
+
+
+def estimate_tokens(llm_request: LlmRequest) -> int:
+    """Rough prompt size in tokens (about four characters per token)"""
+    instruction = llm_request.config.system_instruction if llm_request.config else None
+    chars = len(instruction) if isinstance(instruction, str) else 0
+    for content in llm_request.contents or []:
+        for part in content.parts or []:
+            chars += len(part.text or "")
+    return max(1, chars // 4)
+
+
+async def acquire(llm_request: LlmRequest) -> None:
+    """Wait until both the request and token budgets allow this request"""
+    await get_request_limiter().acquire()
+    token_limiter = get_token_limiter()
+    await token_limiter.acquire(min(estimate_tokens(llm_request), token_limiter.max_rate))
+
+
+class RateLimitedGemini(Gemini):
+    """Gemini model that waits on the shared rate limiters before each call"""
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        await acquire(llm_request)
+        async for response in super().generate_content_async(llm_request, stream):
+            yield response
+
+    @contextlib.asynccontextmanager
+    async def connect(self, llm_request: LlmRequest):
+        await acquire(llm_request)
+        async with super().connect(llm_request) as connection:
+            yield connection
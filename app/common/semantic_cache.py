@@ -0,0 +1,163 @@
+"""
+Approximate cache keyed on sentence embeddings.
+
+Near-duplicate prompts ("30-second ad for a coffee shop in Paris" / "... in Rome")
+map to nearby embeddings, so a cosine-similarity lookup can reuse an earlier result.
+The index can be saved to a file and restored on the next start.
+Requires the optional sentence-transformers and faiss-cpu packages.
+"""
+
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Number of recent embeddings kept so an add after a lookup skips re-encoding
+_RECENT_SIZE = 256
+
+
+def semantic_cache_available() -> bool:
+    """Check whether the optional embedding dependencies are installed"""
+    try:
+        import faiss  # noqa: F401
+        import sentence_transformers  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class SemanticCache:
+    """In-memory nearest-neighbour cache over normalized sentence embeddings"""
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        model_name: str = DEFAULT_EMBEDDING_MODEL,
+        path: Optional[str] = None,
+    ):
+        self.threshold = threshold
+        self.model_name = model_name
+        # Optional file the index is saved to and restored from
+        self.path = path
+        self._model = None
+        self._index = None
+        self._values: List[Any] = []
+        # Lookups are usually followed by an add for the same text
+        self._recent: "OrderedDict[str, Any]" = OrderedDict()
+        # Lookups and adds run in worker threads of concurrent requests; the index,
+        # values and recent embeddings must change together
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _encode(self, texts: List[str]):
+        """Embed texts as L2-normalized float32 vectors"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            logger.info(f"Loading embedding model {self.model_name}")
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(
+            texts, batch_size=32, normalize_embeddings=True, convert_to_numpy=True
+        ).astype("float32")
+
+    def _embed(self, texts: List[str]):
+        """Embed texts in one batch, reusing recently computed vectors"""
+        import numpy as np
+
+        missing = [text for text in dict.fromkeys(texts) if text not in self._recent]
+        if missing:
+            for text, vector in zip(missing, self._encode(missing)):
+                self._recent[text] = vector
+        vectors = np.stack([self._recent[text] for text in texts])
+
+        for text in texts:
+            self._recent.move_to_end(text)
+        while len(self._recent) > _RECENT_SIZE:
+            self._recent.popitem(last=False)
+        return vectors
+
+    def lookup(self, text: str) -> Optional[Any]:
+        """
+        Find the cached value for the most similar text.
+
+        Args:
+            text: Text to look up
+
+        Returns:
+            The cached value if its cosine similarity reaches the threshold, else None
+        """
+        return self.lookup_many([text])[0]
+
+    def lookup_many(self, texts: List[str]) -> List[Optional[Any]]:
+        """Look up several texts with a single embedding pass and index search"""
+        with self._lock:
+            if not self._values or not texts:
+                return [None] * len(texts)
+
+            scores, ids = self._index.search(self._embed(texts), 1)
+            return [
+                self._values[row_ids[0]] if row_scores[0] >= self.threshold else None
+                for row_scores, row_ids in zip(scores, ids)
+            ]
+
+    def add(self, text: str, value: Any) -> None:
+        """Store a value under the embedding of text"""
+        self.add_many([text], [value])
+
+    def add_many(self, texts: List[str], values: List[Any]) -> None:
+        """Store several values under the embeddings of their texts"""
+        if not texts:
+            return
+        with self._lock:
+            vectors = self._embed(texts)
+            if self._index is None:
+                import faiss
+
+                self._index = faiss.IndexFlatIP(vectors.shape[1])
+            self._index.add(vectors)
+            self._values.extend(values)
+
+    def save(self) -> None:
+        """Write the index and values to path, replacing the previous file atomically"""
+        if not self.path:
+            return
+        import faiss
+
+        with self._lock:
+            if self._index is None:
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "wb") as f:
+                pickle.dump(
+                    {
+                        "model": self.model_name,
+                        "index": faiss.serialize_index(self._index),
+                        "values": self._values,
+                    },
+                    f,
+                )
+            os.replace(temp_path, self.path)
+
+    def _load(self) -> None:
+        """Restore a saved index built with the same embedding model"""
+        import faiss
+
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning(f"Could not load semantic cache {self.path}: {e}")
+            return
+        if data.get("model") != self.model_name:
+            return
+        with self._lock:
+            self._index = faiss.deserialize_index(data["index"])
+            self._values = data["values"]
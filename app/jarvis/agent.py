@@ -1,4 +1,9 @@
+import os
+
 from google.adk.agents import Agent
+from google.adk.agents.readonly_context import ReadonlyContext
+from common.env import bootstrap
+from common.ratelimit import RateLimitedGemini
 
 # from google.adk.tools import google_search  # Import the search tool
 from .tools import (
@@ -10,6 +15,10 @@ from .tools import (
     logFitnessProfileJsonTool
 )
 
+bootstrap()
+
+JARVIS_MODEL = os.getenv("JARVIS_MODEL", "gemini-2.0-flash-exp")
+
 systemPrompt = '''# AI Voice Fitness Consultation Training Prompt
 
 ## Role and Purpose
@@ -84,13 +93,8 @@ The JSON should include: age, weight, height, injuries, fitness_goal, workout_fr
 - STAY encouraging even when users need to repeat themselves
 - CALL the logging tool immediately after collecting all data'''
 
-root_agent = Agent(
-    # A unique name for the agent.
-    name="jarvis",
-    model="gemini-2.0-flash-exp",
-    description="Agent to gather user info for gym plan.",
-    # instruction=systemPrompt,
-    instruction=f"""
+# Today's date is filled in per session by jarvis_instruction
+instructionTemplate = """
     You are Jarvis, a helpful assistant that can perform various tasks 
     helping with scheduling and calendar operations.
     
@@ -138,8 +142,22 @@ root_agent = Agent(
     - NEVER show the raw response from a tool_outputs. Instead, use the information to answer the question.
     - NEVER show ```tool_outputs...``` in your response.
 
-    Today's date is {get_current_time()}.
-    """,
+    Today's date is {today}.
+    """
+
+
+def jarvis_instruction(context: ReadonlyContext) -> str:
+    """Build the jarvis instruction with the current date"""
+    return instructionTemplate.format(today=get_current_time())
+
+
+root_agent = Agent(
+    # A unique name for the agent.
+    name="jarvis",
+    model=RateLimitedGemini(model=JARVIS_MODEL),
+    description="Agent to gather user info for gym plan.",
+    # instruction=systemPrompt,
+    instruction=jarvis_instruction,
     tools=[
         list_events,
         create_event,
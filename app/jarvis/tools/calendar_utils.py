@@ -2,11 +2,13 @@
 Utility functions for Google Calendar integration.
 """
 
-import json
+import asyncio
+import functools
 import os
 from datetime import datetime
 from pathlib import Path
 
+import orjson
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -20,6 +22,23 @@ TOKEN_PATH = Path(os.path.expanduser("~/.credentials/calendar_token.json"))
 CREDENTIALS_PATH = Path("credentials.json")
 
 
+def run_in_thread(func):
+    """
+    Expose a blocking Calendar API call as an async tool.
+
+    The Google API client is synchronous, so the call runs in a worker thread
+    instead of stalling the event loop shared with the WebSocket sessions.
+    The wrapped function keeps its name, signature and docstring, which ADK
+    uses to build the tool declaration.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    return wrapper
+
+
 def get_calendar_service():
     """
     Authenticate and create a Google Calendar service object.
@@ -32,7 +51,7 @@ def get_calendar_service():
     # Check if token exists and is valid
     if TOKEN_PATH.exists():
         creds = Credentials.from_authorized_user_info(
-            json.loads(TOKEN_PATH.read_text()), SCOPES
+            orjson.loads(TOKEN_PATH.read_bytes()), SCOPES
         )
 
     # If credentials don't exist or are invalid, refresh or get new ones
@@ -4,9 +4,10 @@ Create event tool for Google Calendar integration.
 
 import datetime
 
-from .calendar_utils import get_calendar_service, parse_datetime
+from .calendar_utils import get_calendar_service, parse_datetime, run_in_thread
 
 
+@run_in_thread
 def create_event(
     summary: str,
     start_time: str,
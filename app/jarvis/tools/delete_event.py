@@ -2,9 +2,10 @@
 Delete event tool for Google Calendar integration.
 """
 
-from .calendar_utils import get_calendar_service
+from .calendar_utils import get_calendar_service, run_in_thread
 
 
+@run_in_thread
 def delete_event(
     event_id: str,
     confirm: bool,
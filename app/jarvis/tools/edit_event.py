@@ -2,9 +2,10 @@
 Edit event tool for Google Calendar integration.
 """
 
-from .calendar_utils import get_calendar_service, parse_datetime
+from .calendar_utils import get_calendar_service, parse_datetime, run_in_thread
 
 
+@run_in_thread
 def edit_event(
     event_id: str,
     summary: str,
@@ -4,9 +4,10 @@ List events tool for Google Calendar integration.
 
 import datetime
 
-from .calendar_utils import format_event_time, get_calendar_service
+from .calendar_utils import format_event_time, get_calendar_service, run_in_thread
 
 
+@run_in_thread
 def list_events(
     start_date: str,
     days: int,
@@ -1,13 +1,20 @@
 import asyncio
 import base64
-import json
+import hashlib
 import os
+import sys
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import AsyncIterable,Optional
 
-from dotenv import load_dotenv
-from fastapi import FastAPI, Query, WebSocket
-from fastapi.responses import FileResponse
+import msgpack
+import msgspec
+import orjson
+import uvicorn
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from google.adk.agents import LiveRequestQueue
 from google.adk.agents.run_config import RunConfig
@@ -15,12 +22,12 @@ from google.adk.events.event import Event
 from google.adk.runners import Runner
 from google.adk.sessions.in_memory_session_service import InMemorySessionService
 from google.genai import types
+from common.env import bootstrap
 from jarvis.agent import root_agent
-from utils.utility import get_model_configs,call_agent_async
-from utils.video_gen import generate_video_sequence
-from utils.video_editor import stitch_videos
+from ScriptWriter.agent import check_script, correction_prompt, video_duration
+from utils.utility import get_model_configs, stream_script_lines
 
-from utils.video_generation import VideoProcessingPipeline, VideoGenerationConfig
+from utils.video_generation import VideoProcessingPipeline, VideoGenerationConfig, close_shared_session
 
 import time
 import logging
@@ -30,11 +37,47 @@ from fastapi import HTTPException
 #
 
 # Load Gemini API Key
-load_dotenv()
+bootstrap()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 APP_NAME = "ADK Streaming example"
 session_service = InMemorySessionService()
 
+# Create speech config with voice settings
+SPEECH_CONFIG = types.SpeechConfig(
+    voice_config=types.VoiceConfig(
+        # Puck, Charon, Kore, Fenrir, Aoede, Leda, Orus, and Zephyr
+        prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Puck")
+    )
+)
+
+# Run configs are built once per response modality and shared by all sessions
+RUN_CONFIG_TEXT = RunConfig(response_modalities=["TEXT"], speech_config=SPEECH_CONFIG)
+
+# Add output_audio_transcription in audio mode to get both audio and text
+RUN_CONFIG_AUDIO = RunConfig(
+    response_modalities=["AUDIO"],
+    speech_config=SPEECH_CONFIG,
+    output_audio_transcription={},
+)
+
+# Global runner instance, shared by every WebSocket session
+_runner = None
+
+def get_runner() -> Runner:
+    """Get or create the Runner for the streaming agent"""
+    global _runner
+    if _runner is None:
+        _runner = Runner(
+            app_name=APP_NAME,
+            agent=root_agent,
+            session_service=session_service,
+        )
+    return _runner
+
 
 def start_agent_session(session_id, is_audio=False):
     """Starts an agent session"""
@@ -46,38 +89,14 @@ def start_agent_session(session_id, is_audio=False):
         session_id=session_id,
     )
 
-    # Create a Runner
-    runner = Runner(
-        app_name=APP_NAME,
-        agent=root_agent,
-        session_service=session_service,
-    )
-
-    # Set response modality
-    modality = "AUDIO" if is_audio else "TEXT"
-
-    # Create speech config with voice settings
-    speech_config = types.SpeechConfig(
-        voice_config=types.VoiceConfig(
-            # Puck, Charon, Kore, Fenrir, Aoede, Leda, Orus, and Zephyr
-            prebuilt_voice_config=types.PrebuiltVoiceConfig(voice_name="Puck")
-        )
-    )
-
-    # Create run config with basic settings
-    config = {"response_modalities": [modality], "speech_config": speech_config}
-
-    # Add output_audio_transcription when audio is enabled to get both audio and text
-    if is_audio:
-        config["output_audio_transcription"] = {}
-
-    run_config = RunConfig(**config)
+    # Pick the prebuilt run config for the response modality
+    run_config = RUN_CONFIG_AUDIO if is_audio else RUN_CONFIG_TEXT
 
     # Create a LiveRequestQueue for this session
     live_request_queue = LiveRequestQueue()
 
     # Start agent session
-    live_events = runner.run_live(
+    live_events = get_runner().run_live(
         session=session,
         live_request_queue=live_request_queue,
         run_config=run_config,
@@ -85,23 +104,86 @@ def start_agent_session(session_id, is_audio=False):
     return live_events, live_request_queue
 
 
+# Partial text deltas are buffered for this long and sent as one frame
+TEXT_FLUSH_INTERVAL = 0.020
+
+# JSON text frame around a Base64 audio chunk, equivalent to the dict form
+AUDIO_FRAME_PREFIX = '{"mime_type":"audio/pcm","role":"model","data":"'
+AUDIO_FRAME_SUFFIX = '"}'
+
+
+async def send_message(websocket: WebSocket, message: dict, binary: bool = False):
+    """Send a frame to the client as MessagePack bytes or JSON text"""
+    if binary:
+        await websocket.send_bytes(msgpack.packb(message, use_bin_type=True))
+    else:
+        await websocket.send_text(orjson.dumps(message).decode())
+
+
+async def receive_message(websocket: WebSocket, binary: bool = False) -> dict:
+    """Receive a frame from the client as MessagePack bytes or JSON text"""
+    if binary:
+        return msgpack.unpackb(await websocket.receive_bytes(), raw=False)
+    return orjson.loads(await websocket.receive_text())
+
+
 async def agent_to_client_messaging(
-    websocket: WebSocket, live_events: AsyncIterable[Event | None]
+    websocket: WebSocket, live_events: AsyncIterable[Event | None], binary: bool = False
 ):
     """Agent to client communication"""
-    while True:
-        async for event in live_events:
+    loop = asyncio.get_running_loop()
+    events = aiter(live_events)
+    pending_text = []
+    flush_deadline = None
+    next_event = None
+
+    async def flush_text():
+        """Send the buffered partial text as one frame"""
+        nonlocal flush_deadline
+        flush_deadline = None
+        if not pending_text:
+            return
+        text = "".join(pending_text)
+        pending_text.clear()
+        message = {
+            "mime_type": "text/plain",
+            "data": text,
+            "role": "model",
+        }
+        await send_message(websocket, message, binary)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("[AGENT TO CLIENT]: text/plain: %s", text)
+
+    try:
+        while True:
+            try:
+                if flush_deadline is None:
+                    event = await anext(events)
+                else:
+                    # Wait for the next event only until the buffered text is due
+                    next_event = asyncio.ensure_future(anext(events))
+                    done, _ = await asyncio.wait(
+                        {next_event}, timeout=max(0, flush_deadline - loop.time())
+                    )
+                    if not done:
+                        await flush_text()
+                    event = await next_event
+            except StopAsyncIteration:
+                # The live stream ended; don't re-enter the exhausted iterator
+                break
+
             if event is None:
                 continue
 
-            # If the turn complete or interrupted, send it
+            # If the turn complete or interrupted, send it after the buffered text
             if event.turn_complete or event.interrupted:
+                await flush_text()
                 message = {
                     "turn_complete": event.turn_complete,
                     "interrupted": event.interrupted,
                 }
-                await websocket.send_text(json.dumps(message))
-                print(f"[AGENT TO CLIENT]: {message}")
+                await send_message(websocket, message, binary)
+                logger.debug("[AGENT TO CLIENT]: %s", message)
                 continue
 
             # Read the Content and its first Part
@@ -116,15 +198,13 @@ async def agent_to_client_messaging(
             # Only send text if it's a partial response (streaming)
             # Skip the final complete message to avoid duplication
             if part.text and event.partial:
-                message = {
-                    "mime_type": "text/plain",
-                    "data": part.text,
-                    "role": "model",
-                }
-                await websocket.send_text(json.dumps(message))
-                print(f"[AGENT TO CLIENT]: text/plain: {part.text}")
+                # Coalesce streamed text deltas into one frame per flush interval
+                pending_text.append(part.text)
+                if flush_deadline is None:
+                    flush_deadline = loop.time() + TEXT_FLUSH_INTERVAL
+                continue
 
-            # If it's audio, send Base64 encoded audio data
+            # If it's audio, send raw bytes (MessagePack) or Base64 encoded audio data (JSON)
             is_audio = (
                 part.inline_data
                 and part.inline_data.mime_type
@@ -132,24 +212,35 @@ async def agent_to_client_messaging(
             )
             if is_audio:
                 audio_data = part.inline_data and part.inline_data.data
-                if audio_data:
-                    message = {
-                        "mime_type": "audio/pcm",
-                        "data": base64.b64encode(audio_data).decode("ascii"),
-                        "role": "model",
-                    }
-                    await websocket.send_text(json.dumps(message))
-                    print(f"[AGENT TO CLIENT]: audio/pcm: {len(audio_data)} bytes.")
+                if not audio_data:
+                    continue
+                # Audio follows the text that preceded it
+                await flush_text()
+                if binary:
+                    message = {"mime_type": "audio/pcm", "data": audio_data, "role": "model"}
+                    await send_message(websocket, message, binary)
+                else:
+                    # Base64 never needs JSON escaping, so the frame is assembled directly
+                    await websocket.send_text(
+                        AUDIO_FRAME_PREFIX + base64.b64encode(audio_data).decode("ascii") + AUDIO_FRAME_SUFFIX
+                    )
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[AGENT TO CLIENT]: audio/pcm: %d bytes.", len(audio_data))
+
+        await flush_text()
+    finally:
+        # Don't leave a pending read on the live stream behind when cancelled
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
 
 
 async def client_to_agent_messaging(
-    websocket: WebSocket, live_request_queue: LiveRequestQueue
+    websocket: WebSocket, live_request_queue: LiveRequestQueue, binary: bool = False
 ):
     """Client to agent communication"""
     while True:
-        # Decode JSON message
-        message_json = await websocket.receive_text()
-        message = json.loads(message_json)
+        # Decode JSON or MessagePack message
+        message = await receive_message(websocket, binary)
         mime_type = message["mime_type"]
         data = message["data"]
         role = message.get("role", "user")  # Default to 'user' if role is not provided
@@ -159,10 +250,11 @@ async def client_to_agent_messaging(
             # Send a text message
             content = types.Content(role=role, parts=[types.Part.from_text(text=data)])
             live_request_queue.send_content(content=content)
-            print(f"[CLIENT TO AGENT PRINT]: {data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[CLIENT TO AGENT]: %s", data)
         elif mime_type == "audio/pcm":
-            # Send audio data
-            decoded_data = base64.b64decode(data)
+            # Send audio data (MessagePack frames already carry raw bytes)
+            decoded_data = data if isinstance(data, bytes) else base64.b64decode(data)
 
             # Send the audio data - note that ActivityStart/End and transcription
             # handling is done automatically by the ADK when input_audio_transcription
@@ -170,7 +262,8 @@ async def client_to_agent_messaging(
             live_request_queue.send_realtime(
                 types.Blob(data=decoded_data, mime_type=mime_type)
             )
-            print(f"[CLIENT TO AGENT]: audio/pcm: {len(decoded_data)} bytes")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[CLIENT TO AGENT]: audio/pcm: %d bytes", len(decoded_data))
 
         else:
             raise ValueError(f"Mime type not supported: {mime_type}")
@@ -180,26 +273,79 @@ async def client_to_agent_messaging(
 # FastAPI web app
 #
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check the server setup on startup and release shared clients on shutdown"""
+    loop_module = type(asyncio.get_running_loop()).__module__
+    if not loop_module.startswith("uvloop"):
+        logger.warning(
+            f"Running on the {loop_module} event loop; start uvicorn with --loop uvloop "
+            "--http httptools (or python main.py) for faster WebSocket handling"
+        )
+    yield
+    # Release pooled connections to the video generation API
+    await close_shared_session()
+
+
+app = FastAPI(lifespan=lifespan)
 
 STATIC_DIR = Path("static")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
+# index.html is read and hashed once; clients revalidate with If-None-Match
+_index_bytes = (STATIC_DIR / "index.html").read_bytes()
+_index_etag = f'"{hashlib.blake2b(_index_bytes, digest_size=8).hexdigest()}"'
+_index_headers = {"ETag": _index_etag, "Cache-Control": "public, max-age=60"}
+
+
 @app.get("/")
-async def root():
+async def root(request: Request):
     """Serves the index.html"""
-    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+    if request.headers.get("if-none-match") == _index_etag:
+        return Response(status_code=304, headers=_index_headers)
+    return Response(content=_index_bytes, media_type="text/html", headers=_index_headers)
 
 
-# Import the optimized classes (assuming they're in a separate module)
+# Generated videos, named by topic cache key and reused for VIDEO_CACHE_TTL seconds
+GENERATED_VIDEOS_DIR = "./generated_videos"
+VIDEO_CACHE_TTL = int(os.getenv("VIDEO_CACHE_TTL", 24 * 3600))
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Scratch space for downloaded clips; tmpfs on Linux keeps them off the disk
+TEMP_VIDEOS_DIR = os.getenv(
+    "TEMP_VIDEOS_DIR",
+    "/dev/shm/temp_videos" if sys.platform.startswith("linux") and os.path.isdir("/dev/shm") else "./temp_videos",
+)
+
+def _keep_in_topic(codepoint: int) -> Optional[int]:
+    """Translation of one character: kept if alphanumeric, ' ', '_' or '-'"""
+    char = chr(codepoint)
+    return codepoint if char.isalnum() or char in " _-" else None
+
+
+class SafeTopicTable(dict):
+    """str.translate table keeping alphanumerics, spaces, '_' and '-'"""
+
+    def __init__(self):
+        # ASCII is decided up front and looked up in C; the table never grows,
+        # so user-supplied topics cannot inflate it
+        super().__init__((codepoint, _keep_in_topic(codepoint)) for codepoint in range(128))
+
+    def __missing__(self, codepoint):
+        # Other characters are decided on every lookup without being stored
+        return _keep_in_topic(codepoint)
+
+
+SAFE_TOPIC_TABLE = SafeTopicTable()
+
+
+class VideoFileResponse(FileResponse):
+    """FileResponse that reads large videos in 1 MiB chunks instead of 64 KiB"""
+    chunk_size = 1024 * 1024
 
-# Create FastAPI app
-app = FastAPI()
+
+# Thread pool for blocking file operations such as bulk deletes
+_file_pool = ThreadPoolExecutor(max_workers=8)
 
 # Global pipeline instance (optional - for reusing sessions)
 _video_pipeline = None
@@ -212,7 +358,9 @@ def get_video_pipeline() -> VideoProcessingPipeline:
             max_workers=2,  # Adjust based on your server capacity
             timeout=300,    # 5 minutes timeout
             max_retries=3,  # Retry failed generations
-            temp_dir="./temp_videos"  # Specify temp directory
+            temp_dir=TEMP_VIDEOS_DIR,  # Specify temp directory
+            semantic_cache=os.getenv("VIDEO_SEMANTIC_CACHE", "").lower() in ("1", "true", "yes"),
+            join_rate=float(os.getenv("VIDEO_JOIN_RATE", 20))  # Queue joins per second
         )
         # Create temp directory if it doesn't exist
         os.makedirs(config.temp_dir, exist_ok=True)
@@ -220,11 +368,105 @@ def get_video_pipeline() -> VideoProcessingPipeline:
     
     return _video_pipeline
 
+async def fetch_script(runner: Runner, session_id: str, query: str) -> list:
+    """
+    Stream the script agent response and collect its scenes as they complete
+    
+    Each scene object is decoded on its own as soon as it closes, so the full
+    response is never buffered and parsed as one document.
+    
+    Args:
+        runner: Runner for the script writer agent
+        session_id: Session ID to run in
+        query: Prompt for the script agent
+    
+    Returns:
+        List of scene dictionaries
+    """
+    try:
+        scenes_data = [
+            scene async for scene in stream_script_lines(runner, "shajid", session_id, query)
+        ]
+    except msgspec.DecodeError as e:
+        logger.error(f"Failed to parse agent response: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Invalid JSON returned from agent",
+                "details": str(e)
+            }
+        )
+    
+    # Validate scenes data
+    if not scenes_data:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Invalid or empty scenes data"}
+        )
+    
+    logger.info(f"Extracted {len(scenes_data)} scenes from script")
+    return scenes_data
+
+
+def video_cache_key(topic: str) -> str:
+    """Cache key of the video generated for a topic at the configured duration"""
+    return hashlib.blake2b(f"{topic}|{video_duration}".encode(), digest_size=16).hexdigest()
+
+
+def video_etag(cache_key: str, video_stat: os.stat_result) -> str:
+    """ETag of a generated video; changes whenever the file is regenerated"""
+    return f'"{cache_key}-{video_stat.st_mtime_ns:x}-{video_stat.st_size:x}"'
+
+
+# One lock per video being generated, so concurrent requests for a topic run
+# the pipeline once; entries disappear when no request holds them
+_video_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def video_lock(cache_key: str) -> asyncio.Lock:
+    """Get the generation lock of a cached video"""
+    lock = _video_locks.get(cache_key)
+    if lock is None:
+        lock = _video_locks[cache_key] = asyncio.Lock()
+    return lock
+
+
+def fresh_video_stat(path: str) -> Optional[os.stat_result]:
+    """Stat a cached video, or None if it is missing, empty or older than VIDEO_CACHE_TTL"""
+    try:
+        video_stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if video_stat.st_size == 0 or time.time() - video_stat.st_mtime >= VIDEO_CACHE_TTL:
+        return None
+    return video_stat
+
+
+def video_response(path: str, video_stat: os.stat_result, safe_topic: str, etag: str) -> VideoFileResponse:
+    """Build the download response for a generated video"""
+    # Reuse the stat so the response does not stat the file again
+    return VideoFileResponse(
+        path,
+        media_type="video/mp4",
+        filename=f"{safe_topic}_video.mp4",
+        stat_result=video_stat,
+        headers={
+            "Content-Disposition": f"attachment; filename=\"{safe_topic}_video.mp4\"",
+            "Cache-Control": "no-cache",
+            "ETag": etag,
+            "Accept-Ranges": "bytes"
+        }
+    )
+
+
 @app.get("/generate-video")
-async def generate_video(topic: str, duration: Optional[int] = 30):
+async def generate_video(request: Request, topic: str, duration: Optional[int] = 30):
     """
     Generate video from topic using optimized pipeline
     
+    Videos are cached per topic for VIDEO_CACHE_TTL seconds; repeated requests are
+    served from disk and answer If-None-Match with 304.
+    
     Args:
         topic: Video topic/description
         duration: Video duration in seconds (not used in current implementation)
@@ -233,95 +475,25 @@ async def generate_video(topic: str, duration: Optional[int] = 30):
         FileResponse with generated video or error response
     """
     try:
-        logger.info(f"Starting video generation for topic: {topic}")
-        
-        # Get model configs and call agent (your existing code)
-        runner, session_id = get_model_configs(USER_ID="shajid")
-        raw_response = await call_agent_async(
-            runner=runner,
-            user_id="shajid",
-            session_id=session_id,
-            query=topic
-        )
-        
-        # Parse the agent response
-        try:
-            response = json.loads(raw_response)
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse agent response: {e}")
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "error": "Invalid JSON returned from agent",
-                    "raw_response": raw_response[:500]  # Truncate for safety
-                }
-            )
-        
-        # Extract script from response
-        if isinstance(response, dict) and "script" in response:
-            scenes_data = response["script"]
-            logger.info(f"Extracted {len(scenes_data)} scenes from script")
-        else:
-            logger.error("No 'script' key found in agent response")
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "No 'script' key in response", 
-                    "parsed_response": response
-                }
-            )
-        
-        # Validate scenes data
-        if not scenes_data or not isinstance(scenes_data, list):
-            raise HTTPException(
-                status_code=400,
-                detail={"error": "Invalid or empty scenes data"}
-            )
-        
-        # Get the optimized pipeline
-        pipeline = get_video_pipeline()
+        safe_topic = topic[:20].translate(SAFE_TOPIC_TABLE).strip()
+        cache_key = video_cache_key(topic)
+        output_path = os.path.join(GENERATED_VIDEOS_DIR, f"{cache_key}.mp4")
         
-        # Generate unique output filename
-        timestamp = int(time.time())
-        safe_topic = "".join(c for c in topic[:20] if c.isalnum() or c in (' ', '_', '-')).strip()
-        output_filename = f"generated_video_{safe_topic}_{timestamp}.mp4"
-        output_path = f"./generated_videos/{output_filename}"
+        # Serve a recent video for the same topic without rerunning the pipeline
+        cached_stat = fresh_video_stat(output_path)
+        if cached_stat is None:
+            # Concurrent requests for a topic generate it once; the others wait
+            # here and are then served the finished file
+            async with video_lock(cache_key):
+                cached_stat = fresh_video_stat(output_path)
+                if cached_stat is None:
+                    return await generate_and_respond(topic, safe_topic, cache_key, output_path)
         
-        # Create output directory if it doesn't exist
-        os.makedirs("./generated_videos", exist_ok=True)
-        
-        # Run the optimized pipeline
-        logger.info("Starting video generation and stitching pipeline...")
-        result = await pipeline.generate_and_stitch_video(scenes_data, output_path)
-        
-        if result.get('success'):
-            logger.info(f"Video generation successful: {result['path']}")
-            
-            # Verify file exists and has content
-            if not os.path.exists(result['path']) or os.path.getsize(result['path']) == 0:
-                raise HTTPException(
-                    status_code=500,
-                    detail={"error": "Generated video file is missing or empty"}
-                )
-            
-            return FileResponse(
-                result["path"],
-                media_type="video/mp4",
-                filename=f"{safe_topic}_video.mp4",
-                headers={
-                    "Content-Disposition": f"attachment; filename=\"{safe_topic}_video.mp4\"",
-                    "Cache-Control": "no-cache"
-                }
-            )
-        else:
-            logger.error(f"Video generation failed: {result}")
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "error": "Failed to generate/stitch videos", 
-                    "details": result.get('error', 'Unknown error')
-                }
-            )
+        logger.info(f"Serving cached video for topic: {topic}")
+        etag = video_etag(cache_key, cached_stat)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        return video_response(output_path, cached_stat, safe_topic, etag)
             
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -337,6 +509,68 @@ async def generate_video(topic: str, duration: Optional[int] = 30):
         )
 
 
+async def generate_and_respond(topic: str, safe_topic: str, cache_key: str, output_path: str) -> VideoFileResponse:
+    """
+    Run the script agent and video pipeline for a topic and respond with the video
+    
+    Args:
+        topic: Video topic/description
+        safe_topic: Topic sanitized for the download file name
+        cache_key: Cache key of the topic's video
+        output_path: Path the stitched video is written to
+    
+    Returns:
+        FileResponse with the generated video
+    """
+    logger.info(f"Starting video generation for topic: {topic}")
+    
+    # Get model configs and call agent (your existing code)
+    runner, session_id = get_model_configs(USER_ID="shajid")
+    scenes_data = await fetch_script(runner, session_id, topic)
+
+    # Retry once with a corrective prompt if the script breaks the contract
+    if not check_script(scenes_data):
+        logger.warning(
+            f"Script has {len(scenes_data)} scenes, expected {video_duration}; retrying once"
+        )
+        scenes_data = await fetch_script(runner, session_id, correction_prompt())
+    
+    # Get the optimized pipeline
+    pipeline = get_video_pipeline()
+    
+    # Create output directory if it doesn't exist
+    os.makedirs(GENERATED_VIDEOS_DIR, exist_ok=True)
+    
+    # Run the optimized pipeline
+    logger.info("Starting video generation and stitching pipeline...")
+    result = await pipeline.generate_and_stitch_video(scenes_data, output_path)
+    
+    if result.get('success'):
+        logger.info(f"Video generation successful: {result['path']}")
+        
+        # Verify file exists and has content
+        try:
+            video_stat = os.stat(result['path'])
+        except FileNotFoundError:
+            video_stat = None
+        if video_stat is None or video_stat.st_size == 0:
+            raise HTTPException(
+                status_code=500,
+                detail={"error": "Generated video file is missing or empty"}
+            )
+        
+        return video_response(result["path"], video_stat, safe_topic, video_etag(cache_key, video_stat))
+    else:
+        logger.error(f"Video generation failed: {result}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Failed to generate/stitch videos", 
+                "details": result.get('error', 'Unknown error')
+            }
+        )
+
+
 @app.delete("/clear-videos")
 async def clear_generated_videos():
     """
@@ -346,47 +580,46 @@ async def clear_generated_videos():
         Dictionary with operation status and details
     """
     try:
-        videos_dir = Path("./generated_videos")
-        temp_dir = Path("./temp_videos")
+        videos_dir = Path(GENERATED_VIDEOS_DIR)
+        temp_dir = Path(TEMP_VIDEOS_DIR)
         
         deleted_files = []
         errors = []
         
-        # Clear generated_videos directory
-        if videos_dir.exists():
-            for file_path in videos_dir.iterdir():
-                try:
-                    if file_path.is_file():
-                        file_size = file_path.stat().st_size
-                        file_path.unlink()  # Delete the file
-                        deleted_files.append({
-                            "file": str(file_path.name),
-                            "size_bytes": file_size,
-                            "type": "generated_video"
-                        })
-                        logger.info(f"Deleted: {file_path.name}")
-                except Exception as e:
-                    error_msg = f"Failed to delete {file_path.name}: {str(e)}"
-                    errors.append(error_msg)
-                    logger.error(error_msg)
+        # Collect the files of both directories first
+        targets = []
+        for directory, file_type in ((videos_dir, "generated_video"), (temp_dir, "temp_video")):
+            if not directory.exists():
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            targets.append((entry, entry.stat().st_size, file_type))
+                    except OSError as e:
+                        error_msg = f"Failed to read {entry.name}: {str(e)}"
+                        errors.append(error_msg)
+                        logger.error(error_msg)
         
-        # Clear temp_videos directory
-        if temp_dir.exists():
-            for file_path in temp_dir.iterdir():
-                try:
-                    if file_path.is_file():
-                        file_size = file_path.stat().st_size
-                        file_path.unlink()  # Delete the file
-                        deleted_files.append({
-                            "file": str(file_path.name),
-                            "size_bytes": file_size,
-                            "type": "temp_video"
-                        })
-                        logger.info(f"Deleted temp file: {file_path.name}")
-                except Exception as e:
-                    error_msg = f"Failed to delete temp file {file_path.name}: {str(e)}"
-                    errors.append(error_msg)
-                    logger.error(error_msg)
+        # Delete them concurrently on the file pool, off the event loop
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *[loop.run_in_executor(_file_pool, os.unlink, entry.path) for entry, _, _ in targets],
+            return_exceptions=True
+        )
+        
+        for (entry, file_size, file_type), result in zip(targets, results):
+            if isinstance(result, Exception):
+                error_msg = f"Failed to delete {entry.name}: {str(result)}"
+                errors.append(error_msg)
+                logger.error(error_msg)
+            else:
+                deleted_files.append({
+                    "file": entry.name,
+                    "size_bytes": file_size,
+                    "type": file_type
+                })
+                logger.info(f"Deleted: {entry.name}")
         
         # Calculate total space freed
         total_bytes_freed = sum(file_info["size_bytes"] for file_info in deleted_files)
@@ -427,36 +660,39 @@ async def list_generated_videos():
         Dictionary with list of videos and directory info
     """
     try:
-        videos_dir = Path("./generated_videos")
-        temp_dir = Path("./temp_videos")
+        videos_dir = Path(GENERATED_VIDEOS_DIR)
+        temp_dir = Path(TEMP_VIDEOS_DIR)
         
         video_files = []
         temp_files = []
         
         # List generated videos
         if videos_dir.exists():
-            for file_path in videos_dir.iterdir():
-                if file_path.is_file() and file_path.suffix.lower() == '.mp4':
-                    stat = file_path.stat()
-                    video_files.append({
-                        "name": file_path.name,
-                        "size_bytes": stat.st_size,
-                        "size_mb": round(stat.st_size / (1024 * 1024), 2),
-                        "created_time": time.ctime(stat.st_ctime),
-                        "modified_time": time.ctime(stat.st_mtime)
-                    })
+            with os.scandir(videos_dir) as entries:
+                for entry in entries:
+                    # Filter on the name first so other files are never stat'ed
+                    if entry.name.lower().endswith('.mp4') and entry.is_file():
+                        stat = entry.stat()
+                        video_files.append({
+                            "name": entry.name,
+                            "size_bytes": stat.st_size,
+                            "size_mb": round(stat.st_size / (1024 * 1024), 2),
+                            "created_time": time.ctime(stat.st_ctime),
+                            "modified_time": time.ctime(stat.st_mtime)
+                        })
         
         # List temp files
         if temp_dir.exists():
-            for file_path in temp_dir.iterdir():
-                if file_path.is_file():
-                    stat = file_path.stat()
-                    temp_files.append({
-                        "name": file_path.name,
-                        "size_bytes": stat.st_size,
-                        "size_mb": round(stat.st_size / (1024 * 1024), 2),
-                        "created_time": time.ctime(stat.st_ctime)
-                    })
+            with os.scandir(temp_dir) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        temp_files.append({
+                            "name": entry.name,
+                            "size_bytes": stat.st_size,
+                            "size_mb": round(stat.st_size / (1024 * 1024), 2),
+                            "created_time": time.ctime(stat.st_ctime)
+                        })
         
         # Calculate totals
         total_video_size = sum(f["size_bytes"] for f in video_files)
@@ -492,12 +728,14 @@ async def websocket_endpoint(
     websocket: WebSocket,
     session_id: str,
     is_audio: str = Query(...),
+    fmt: str = Query("json"),
 ):
-    """Client websocket endpoint"""
+    """Client websocket endpoint; pass fmt=msgpack for binary MessagePack frames"""
 
     # Wait for client connection
     await websocket.accept()
-    print(f"Client #{session_id} connected, audio mode: {is_audio}")
+    binary = fmt == "msgpack"
+    print(f"Client #{session_id} connected, audio mode: {is_audio}, format: {fmt}")
 
     # Start agent session
     live_events, live_request_queue = start_agent_session(
@@ -506,12 +744,36 @@ async def websocket_endpoint(
 
     # Start tasks
     agent_to_client_task = asyncio.create_task(
-        agent_to_client_messaging(websocket, live_events)
+        agent_to_client_messaging(websocket, live_events, binary)
     )
     client_to_agent_task = asyncio.create_task(
-        client_to_agent_messaging(websocket, live_request_queue)
+        client_to_agent_messaging(websocket, live_request_queue, binary)
+    )
+    # Whichever side ends first tears down the other
+    done, pending = await asyncio.wait(
+        {agent_to_client_task, client_to_agent_task},
+        return_when=asyncio.FIRST_COMPLETED,
     )
-    await asyncio.gather(agent_to_client_task, client_to_agent_task)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    live_request_queue.close()
+
+    for task in done:
+        error = task.exception()
+        if error and not isinstance(error, WebSocketDisconnect):
+            logger.error(f"Client #{session_id} session failed: {error!r}")
 
     # Disconnected
     print(f"Client #{session_id} disconnected")
+
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        loop="uvloop" if sys.platform != "win32" else "auto",
+        http="httptools",
+        ws="websockets",
+    )
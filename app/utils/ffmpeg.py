@@ -0,0 +1,139 @@
+"""
+Helpers for joining already-encoded clips with the ffmpeg CLI.
+
+Clips that share codecs, resolution and frame rate can be joined with the concat
+demuxer and stream copy, which skips the decode and re-encode MoviePy does.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import shutil
+import tempfile
+from typing import List, Optional
+
+
+@functools.cache
+def ffmpeg_path() -> Optional[str]:
+    """Locate ffmpeg on PATH, falling back to the binary bundled for MoviePy"""
+    path = shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+@functools.cache
+def ffprobe_path() -> Optional[str]:
+    """Locate ffprobe on PATH"""
+    return shutil.which("ffprobe")
+
+
+async def _run(*args: str) -> bytes:
+    """Run a command and return its stdout, raising on a non-zero exit"""
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(
+            f"{os.path.basename(args[0])} exited with {process.returncode}: "
+            f"{stderr.decode(errors='replace')[-500:]}"
+        )
+    return stdout
+
+
+async def probe_streams(path: str) -> frozenset:
+    """
+    Describe the streams of a media file.
+
+    Args:
+        path: Media file to inspect
+
+    Returns:
+        Set of (codec_type, codec_name, width, height, r_frame_rate, pix_fmt,
+        sample_rate, channels) tuples; fields that do not apply are None
+    """
+    stdout = await _run(
+        ffprobe_path(),
+        "-v", "error",
+        "-show_entries",
+        "stream=codec_type,codec_name,width,height,r_frame_rate,pix_fmt,sample_rate,channels",
+        "-of", "json",
+        path,
+    )
+    return frozenset(
+        (
+            stream.get("codec_type"),
+            stream.get("codec_name"),
+            stream.get("width"),
+            stream.get("height"),
+            stream.get("r_frame_rate"),
+            stream.get("pix_fmt"),
+            stream.get("sample_rate"),
+            stream.get("channels"),
+        )
+        for stream in json.loads(stdout).get("streams", [])
+    )
+
+
+async def streams_compatible(paths: List[str]) -> bool:
+    """
+    Check whether clips can be joined without re-encoding.
+
+    Returns False when ffmpeg/ffprobe are unavailable or any probe fails, so
+    callers fall back to a re-encode.
+    """
+    if not paths or not ffmpeg_path() or not ffprobe_path():
+        return False
+    try:
+        # Probe every clip at once; each probe is its own ffprobe process
+        probes = await asyncio.gather(*[probe_streams(path) for path in paths])
+    except (RuntimeError, ValueError) as e:
+        print(f"ffprobe failed, falling back to re-encode: {e}")
+        return False
+    return bool(probes[0]) and all(probe == probes[0] for probe in probes[1:])
+
+
+async def concat_copy(paths: List[str], output_path: str, faststart: bool = True) -> str:
+    """
+    Join clips with the ffmpeg concat demuxer and stream copy.
+
+    Args:
+        paths: Clips to join, in order
+        output_path: Path to write the joined video to
+        faststart: Move the moov atom to the front so playback can start
+            before the whole file is downloaded
+
+    Returns:
+        The output path
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".txt", delete=False, dir=os.path.dirname(os.path.abspath(paths[0]))
+    ) as list_file:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", r"'\''")
+            list_file.write(f"file '{escaped}'\n")
+
+    try:
+        await _run(
+            ffmpeg_path(),
+            "-y",
+            "-loglevel", "error",
+            "-f", "concat",
+            "-safe", "0",
+            "-i", list_file.name,
+            "-c", "copy",
+            *(("-movflags", "+faststart") if faststart else ()),
+            output_path,
+        )
+    finally:
+        os.remove(list_file.name)
+    return output_path
@@ -1,5 +1,9 @@
+from typing import AsyncIterator, List
+
+import msgspec
+from google.adk.agents.run_config import RunConfig, StreamingMode
 from google.adk.runners import Runner
-from ScriptWriter.agent import root_agent
+from ScriptWriter.agent import ScriptLineRecord, root_agent
 from google.adk.sessions import InMemorySessionService
 from google.genai import types
 
@@ -136,3 +140,91 @@ async def call_agent_async(runner, user_id, session_id, query):
         print(f"Error during agent call: {e}")
 
     return final_response_text
+
+
+class ScriptLineSplitter:
+    """
+    Incrementally split streamed script JSON into complete line objects.
+
+    Tracks string and bracket state across chunks and returns the raw text of
+    every object that closes directly inside an array, which covers both
+    {"script": [{...}, ...]} and a bare [{...}, ...].
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0  # Next character of the buffer to scan
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._start = None  # Buffer offset of the object being read
+
+    def feed(self, text: str) -> List[str]:
+        """Add a chunk of text and return the objects it completed"""
+        buffer = self._buffer + text
+        items = []
+
+        for i in range(self._pos, len(buffer)):
+            char = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if char == "{" and self._stack and self._stack[-1] == "[":
+                    self._start = i
+                self._stack.append(char)
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                if char == "}" and self._start is not None and self._stack and self._stack[-1] == "[":
+                    items.append(buffer[self._start:i + 1])
+                    self._start = None
+
+        # Only keep the unfinished object around
+        keep_from = self._start if self._start is not None else len(buffer)
+        self._buffer = buffer[keep_from:]
+        self._pos = len(buffer) - keep_from
+        if self._start is not None:
+            self._start = 0
+        return items
+
+
+async def stream_script_lines(runner, user_id, session_id, query) -> AsyncIterator[dict]:
+    """
+    Call the script agent with SSE streaming and yield each script line as soon as it is complete.
+
+    Args:
+        runner: Runner for the script writer agent
+        user_id: User ID of the session
+        session_id: Session ID to run in
+        query: Scene idea to write the script for
+
+    Yields:
+        dict: One script line ("sec", "scene", "dialog", "non_dialog", "gender")
+    """
+    content = types.Content(role="user", parts=[types.Part(text=query)])
+    run_config = RunConfig(streaming_mode=StreamingMode.SSE)
+    splitter = ScriptLineSplitter()
+    streamed = False
+
+    async for event in runner.run_async(
+        user_id=user_id, session_id=session_id, new_message=content, run_config=run_config
+    ):
+        if not (event.content and event.content.parts):
+            continue
+        text = "".join(part.text or "" for part in event.content.parts)
+
+        # The final event repeats the streamed text; only use it when nothing
+        # was streamed (e.g. a cached response)
+        if event.partial:
+            streamed = True
+        elif streamed:
+            continue
+
+        for item in splitter.feed(text):
+            yield msgspec.structs.asdict(msgspec.json.decode(item, type=ScriptLineRecord))
@@ -1,72 +1,133 @@
-import requests
+import asyncio
 import tempfile
 import os
+import shutil
+import sys
+
+import aiofiles
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from moviepy.video.compositing.CompositeVideoClip import concatenate_videoclips
-import time
+from utils.ffmpeg import concat_copy, streams_compatible
+from utils.video_generation import close_shared_session, get_shared_session
 
+# Downloaded clips go to RAM-backed tmpfs where available
+TEMP_DIR = "/dev/shm" if sys.platform.startswith("linux") and os.path.isdir("/dev/shm") else None
 
-def stitch_videos(video_data, output_path="final_video.mp4"):
+
+async def download_video(url, path):
     """
-    Stitches a list of videos (with URLs) into a single video.
+    Downloads a video URL to a local file.
 
     Args:
-        video_data (list): List of dicts containing 'url' of each video.
-        output_path (str): Path to save the final stitched video.
+        url (str): URL of the video.
+        path (str): File path to write the video to.
 
     Returns:
-        str: Path to the stitched video file.
+        str: The path the video was written to.
     """
-    clips = []
-    temp_files = []
+    async with get_shared_session().get(url) as resp:
+        resp.raise_for_status()
+        async with aiofiles.open(path, "wb") as f:
+            async for chunk in resp.content.iter_chunked(1024 * 1024):
+                await f.write(chunk)
+    return path
+
 
+def _concatenate(paths, output_path):
+    """Load the downloaded clips and write them out as one video."""
+    clips = []
     try:
-        # Download each video and create VideoFileClip
-        for item in video_data:
-            print(f"Processing video item: {item}")
-            url = item.get("url")
-            if not url:
-                continue
-
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-            temp_files.append(temp_file.name)
-
-            # Download video content
-            resp = requests.get(url, stream=True)
-            resp.raise_for_status()
-            with open(temp_file.name, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=1024*1024):
-                    if chunk:
-                        f.write(chunk)
-
-            # Load video clip
-            clip = VideoFileClip(temp_file.name)
-            clips.append(clip)
-
-        # Concatenate all clips
-        if not clips:
-            raise ValueError("No valid video clips to stitch.")
-
-        final_clip = concatenate_videoclips(clips, method="compose")
-        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
+        for path in paths:
+            clips.append(VideoFileClip(path))
 
-        # Close all clips
+        # compose is only needed to pad clips of different sizes onto one canvas
+        first = clips[0]
+        same_shape = all(c.size == first.size and c.fps == first.fps for c in clips)
+        final_clip = concatenate_videoclips(clips, method="chain" if same_shape else "compose")
+        final_clip.write_videofile(output_path, codec="libx264", audio_codec="aac")
         final_clip.close()
+    finally:
+        # Close all clips
         for clip in clips:
             clip.close()
 
-        return {"success": True, "path": output_path}
 
-    finally:
-        # Clean up temp files with a small delay
-        for file in temp_files:
-            if os.path.exists(file):
+async def stitch_videos_async(video_data, output_path="final_video.mp4", temp_dir=None):
+    """
+    Stitches a list of videos (with URLs) into a single video.
+
+    All clips are downloaded concurrently. Clips with matching streams are joined
+    by ffmpeg without re-encoding; otherwise MoviePy re-encodes them in a worker
+    thread so the event loop stays free.
+
+    Args:
+        video_data (list): List of dicts containing 'url' of each video.
+        output_path (str): Path to save the final stitched video.
+        temp_dir (str): Directory for the downloaded clips, tmpfs by default on Linux.
+
+    Returns:
+        str: Path to the stitched video file.
+    """
+    for item in video_data:
+        print(f"Processing video item: {item}")
+
+    urls = [item["url"] for item in video_data if item.get("url")]
+    if not urls:
+        raise ValueError("No valid video clips to stitch.")
+
+    # The directory and every clip in it are removed once ffmpeg/MoviePy exit
+    with tempfile.TemporaryDirectory(dir=temp_dir or TEMP_DIR) as work_dir:
+        paths = [os.path.join(work_dir, f"clip_{i}.mp4") for i in range(len(urls))]
+
+        # Download every clip at once; waiting for all of them, failed or not,
+        # keeps writes from landing in the directory while it is removed
+        results = await asyncio.gather(
+            *[download_video(url, path) for url, path in zip(urls, paths)],
+            return_exceptions=True,
+        )
+        for url, result in zip(urls, results):
+            if isinstance(result, BaseException):
+                print(f"Failed to download {url}: {result}")
+        paths = [result for result in results if isinstance(result, str)]
+        if not paths:
+            raise ValueError("No videos downloaded successfully")
+
+        if len(paths) == 1:
+            # A single clip needs no stitching; move it (tmpfs may be another filesystem)
+            await asyncio.to_thread(shutil.move, paths[0], output_path)
+        else:
+            joined = False
+            if await streams_compatible(paths):
+                # Matching streams are joined as-is, without decoding
                 try:
-                    time.sleep(0.1)  # small delay before deletion
-                    os.remove(file)
-                except PermissionError:
-                    print(f"Warning: Could not delete temp file {file} (still in use).")
+                    await concat_copy(paths, output_path)
+                    joined = True
+                except RuntimeError as e:
+                    print(f"ffmpeg concat failed, re-encoding with MoviePy: {e}")
+            if not joined:
+                await asyncio.to_thread(_concatenate, paths, output_path)
+
+    return {"success": True, "path": output_path}
+
+
+def stitch_videos(video_data, output_path="final_video.mp4"):
+    """
+    Synchronous wrapper around stitch_videos_async for scripts.
+
+    Args:
+        video_data (list): List of dicts containing 'url' of each video.
+        output_path (str): Path to save the final stitched video.
+
+    Returns:
+        str: Path to the stitched video file.
+    """
+    async def run():
+        try:
+            return await stitch_videos_async(video_data, output_path)
+        finally:
+            await close_shared_session()
+
+    return asyncio.run(run())
 
 
 # -------------------- Example Usage -------------------- #
@@ -1,18 +1,14 @@
-import requests
-import json
-import time
-import random
-import string
-from typing import List, Dict, Any
-import threading
-from queue import Queue
-import sseclient
-from urllib.parse import urlencode
+import asyncio
+import secrets
+from typing import List, Dict, Any, Optional
+
+import aiohttp
+from utils.video_generation import is_session_not_found, json_dumps, sse_messages
 
 class VideoGenerator:
-    def __init__(self):
+    def __init__(self, session: aiohttp.ClientSession):
         self.base_url = "https://ltx-video.com/api/video/gen"
-        self.session_hash = ""
+        self.session = session
         self.headers = {
             'Content-Type': 'application/json',
             'x-zerogpu-uuid': 'fwmmUsBxWJ9SqpiE-V8r5'
@@ -20,9 +16,9 @@ class VideoGenerator:
     
     def generate_session_hash(self) -> str:
         """Generate a random session hash"""
-        return ''.join(random.choices(string.ascii_letters + string.digits, k=13))
+        return secrets.token_urlsafe(10)[:13]
     
-    def generate_single_video(self, prompt: str, model: str = "epiCRealism", guidance: str = "", steps: int = 4) -> str:
+    async def generate_single_video(self, prompt: str, model: str = "epiCRealism", guidance: str = "", steps: int = 4) -> str:
         """
         Generate a single video from a text prompt
         
@@ -36,8 +32,8 @@ class VideoGenerator:
             URL of the generated video
         """
         try:
-            # Generate session hash
-            self.session_hash = self.generate_session_hash()
+            # Generate session hash (local, several prompts share this generator)
+            session_hash = self.generate_session_hash()
             
             # Queue join request data
             queue_data = {
@@ -45,70 +41,79 @@ class VideoGenerator:
                 "event_data": None,
                 "fn_index": 1,
                 "trigger_id": 10,
-                "session_hash": self.session_hash
+                "session_hash": session_hash
             }
             
+            # Open the result stream while the join is in flight
+            result = asyncio.create_task(self._wait_for_video_result(session_hash))
+            
             # Join the queue
             queue_url = f"{self.base_url}/queue/join?__theme=system"
-            response = requests.post(queue_url, headers=self.headers, json=queue_data)
-            
-            if not response.ok:
-                raise Exception(f"Queue join failed: {response.status_code}")
+            try:
+                async with self.session.post(queue_url, headers=self.headers, json=queue_data) as response:
+                    if not response.ok:
+                        raise Exception(f"Queue join failed: {response.status}")
+            except BaseException:
+                result.cancel()
+                raise
             
             print(f"Video generation queued for: {prompt[:50]}...")
             
-            # Wait for results via SSE
-            video_url = self._wait_for_video_result()
-            return video_url
+            # Wait for results via SSE; if the stream connected before the join
+            # registered the session, reopen it now that the job is queued
+            video_url = await result
+            if video_url is None:
+                video_url = await self._wait_for_video_result(session_hash)
+            return video_url or ""
             
         except Exception as e:
             print(f"Error generating video for prompt '{prompt[:50]}...': {str(e)}")
             return ""
     
-    def _wait_for_video_result(self) -> str:
+    async def _wait_for_video_result(self, session_hash: str) -> Optional[str]:
         """
         Wait for video generation result via Server-Sent Events
         
         Returns:
-            URL of the generated video
+            URL of the generated video, "" on failure, or None if the queue did
+            not know the session (yet)
         """
-        sse_url = f"{self.base_url}/queue/data?session_hash={self.session_hash}"
+        sse_url = f"{self.base_url}/queue/data?session_hash={session_hash}"
         
         try:
-            response = requests.get(sse_url, stream=True, headers={'Accept': 'text/event-stream'})
-            client = sseclient.SSEClient(response)
-            
-            for event in client.events():
-                if event.data:
-                    try:
-                        data = json.loads(event.data)
-                        
-                        if data.get('msg') == 'process_started':
-                            print("Processing video request...")
-                        elif data.get('msg') == 'process_generating':
-                            print("Generating video frames...")
-                        elif data.get('msg') == 'process_completed':
-                            if data.get('output', {}).get('data', [{}])[0].get('video', {}).get('url'):
-                                video_url = data['output']['data'][0]['video']['url']
-                                print("Video generated successfully!")
-                                return video_url
-                            else:
-                                raise Exception('Invalid video data received')
-                        elif data.get('msg') == 'estimation':
-                            if data.get('rank') and data.get('queue_size'):
-                                print(f"Position in queue: {data['rank']} of {data['queue_size']}")
-                        elif data.get('msg') == 'close_stream':
-                            break
-                            
-                    except json.JSONDecodeError:
-                        continue
+            async with self.session.get(sse_url, headers={'Accept': 'text/event-stream'}) as response:
+                if response.status == 404:
+                    return None
+                received = False
+                async for data in sse_messages(response.content):
+                    if is_session_not_found(data):
+                        return None
+                    received = True
+                    if data.get('msg') == 'process_started':
+                        print("Processing video request...")
+                    elif data.get('msg') == 'process_generating':
+                        print("Generating video frames...")
+                    elif data.get('msg') == 'process_completed':
+                        if data.get('output', {}).get('data', [{}])[0].get('video', {}).get('url'):
+                            video_url = data['output']['data'][0]['video']['url']
+                            print("Video generated successfully!")
+                            return video_url
+                        else:
+                            raise Exception('Invalid video data received')
+                    elif data.get('msg') == 'estimation':
+                        if data.get('rank') and data.get('queue_size'):
+                            print(f"Position in queue: {data['rank']} of {data['queue_size']}")
+                    elif data.get('msg') == 'close_stream':
+                        break
+                if not received:
+                    return None
                         
         except Exception as e:
             print(f"SSE Error: {str(e)}")
             
         return ""
 
-def generate_video_sequence(scenes_data: List[Dict[str, Any]], max_workers: int = 3) -> Dict[str, Any]:
+async def generate_video_sequence_async(scenes_data: List[Dict[str, Any]], max_workers: int = 3) -> Dict[str, Any]:
     """
     Generate videos for a sequence of scenes and return results in the specified format
     
@@ -119,70 +124,26 @@ def generate_video_sequence(scenes_data: List[Dict[str, Any]], max_workers: int
     Returns:
         Dictionary with 'response' key containing updated scenes with video URLs
     """
-    
-    def worker_thread(scene_queue: Queue, result_queue: Queue, generator: VideoGenerator):
-        """Worker thread for generating videos"""
-        while True:
-            try:
-                scene = scene_queue.get(timeout=1)
-                if scene is None:
-                    break
-                    
-                print(f"Generating video for second {scene['sec']}: {scene['scene'][:50]}...")
-                
-                # Generate video for this scene
-                video_url = generator.generate_single_video(scene['scene'])
-                
-                # Add URL to scene data
-                scene['url'] = video_url
-                result_queue.put(scene)
-                scene_queue.task_done()
-                
-            except Exception as e:
-                print(f"Worker error: {str(e)}")
-                scene_queue.task_done()
-    
-    # Create queues and generators
-    scene_queue = Queue()
-    result_queue = Queue()
-    generators = [VideoGenerator() for _ in range(max_workers)]
-    
-    # Add scenes to queue
-    for scene in scenes_data:
-        scene_queue.put(scene.copy())
-    
-    # Start worker threads
-    threads = []
-    for generator in generators:
-        thread = threading.Thread(target=worker_thread, args=(scene_queue, result_queue, generator))
-        thread.daemon = True
-        thread.start()
-        threads.append(thread)
-    
-    # Collect results
-    results = []
-    processed_count = 0
-    total_scenes = len(scenes_data)
-    
-    print(f"Starting generation for {total_scenes} scenes with {max_workers} workers...")
-    
-    while processed_count < total_scenes:
-        try:
-            scene_result = result_queue.get(timeout=300)  # 5 minute timeout per scene
-            results.append(scene_result)
-            processed_count += 1
-            print(f"Completed {processed_count}/{total_scenes} scenes")
-        except Exception as e:
-            print(f"Timeout or error waiting for result: {str(e)}")
-            break
-    
-    # Stop worker threads
-    for _ in range(max_workers):
-        scene_queue.put(None)
-    
-    # Wait for threads to finish
-    for thread in threads:
-        thread.join(timeout=10)
+    semaphore = asyncio.Semaphore(max_workers)
+    
+    async def generate_one(generator: VideoGenerator, scene: Dict[str, Any]) -> Dict[str, Any]:
+        async with semaphore:
+            print(f"Generating video for second {scene['sec']}: {scene['scene'][:50]}...")
+            scene['url'] = await generator.generate_single_video(scene['scene'])
+            return scene
+    
+    print(f"Starting generation for {len(scenes_data)} scenes with {max_workers} workers...")
+    
+    # One connection pool for every scene
+    connector = aiohttp.TCPConnector(limit=max_workers * 4)
+    timeout = aiohttp.ClientTimeout(total=300)  # 5 minute timeout per request
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=timeout, json_serialize=json_dumps
+    ) as session:
+        generator = VideoGenerator(session)
+        results = await asyncio.gather(
+            *[generate_one(generator, scene.copy()) for scene in scenes_data]
+        )
     
     # Sort results by second
     results.sort(key=lambda x: x.get('sec', 0))
@@ -191,6 +152,19 @@ def generate_video_sequence(scenes_data: List[Dict[str, Any]], max_workers: int
         "response": results
     }
 
+def generate_video_sequence(scenes_data: List[Dict[str, Any]], max_workers: int = 3) -> Dict[str, Any]:
+    """
+    Synchronous wrapper around generate_video_sequence_async for scripts
+    
+    Args:
+        scenes_data: List of scene dictionaries with 'sec', 'scene', and 'dialog' keys
+        max_workers: Maximum number of concurrent video generations
+        
+    Returns:
+        Dictionary with 'response' key containing updated scenes with video URLs
+    """
+    return asyncio.run(generate_video_sequence_async(scenes_data, max_workers))
+
 # Example usage
 if __name__ == "__main__":
     # Example scene data (like your cat playing with ball example)
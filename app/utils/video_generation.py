@@ -1,22 +1,38 @@
 import asyncio
 import aiohttp
+import aiofiles
+import aiofiles.os
 import json
+import orjson
 import time
-import random
-import string
+import secrets
 import tempfile
 import os
+import shutil
 import logging
 import sys
-from typing import List, Dict, Any, Optional
-from contextlib import asynccontextmanager, redirect_stdout, redirect_stderr
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+from contextlib import redirect_stdout, redirect_stderr
 from pathlib import Path
-import sseclient
 from moviepy.video.io.VideoFileClip import VideoFileClip
 from moviepy.video.compositing.CompositeVideoClip import concatenate_videoclips
 from dataclasses import dataclass
 from concurrent.futures import ThreadPoolExecutor
+import functools
 import hashlib
+import diskcache
+from aiolimiter import AsyncLimiter
+from common.semantic_cache import SemanticCache, semantic_cache_available
+from utils.ffmpeg import concat_copy, streams_compatible
+import uuid
+
+# Default generation settings
+DEFAULT_MODEL = "epiCRealism"
+DEFAULT_GUIDANCE = ""
+DEFAULT_STEPS = 4
+
+# Bytes read from the network per write when downloading generated videos
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -31,10 +47,19 @@ class VideoGenerationConfig:
     max_retries: int = 3
     retry_delay: float = 1.0
     temp_dir: Optional[str] = None
+    cache_dir: Optional[str] = ".cache/videos"  # None disables the URL/output cache
+    cache_ttl: int = 7 * 24 * 3600
+    semantic_cache: bool = False  # Reuse videos of near-duplicate prompts (needs sentence-transformers + faiss)
+    semantic_threshold: float = 0.85
+    join_rate: float = 20.0  # Queue joins per second shared by all generators of a pipeline
     
     def __post_init__(self):
         if self.temp_dir is None:
-            self.temp_dir = tempfile.gettempdir()
+            # Scene clips only live until they are stitched; keep them in memory on Linux
+            if sys.platform.startswith("linux") and os.path.isdir("/dev/shm"):
+                self.temp_dir = "/dev/shm"
+            else:
+                self.temp_dir = tempfile.gettempdir()
 
 @dataclass
 class Scene:
@@ -43,57 +68,141 @@ class Scene:
     scene: str
     dialog: str
     url: Optional[str] = None
+    non_dialog: str = ""
+    gender: str = ""
     
     @property
     def cache_key(self) -> str:
         """Generate cache key for the scene"""
         return hashlib.md5(f"{self.scene}".encode()).hexdigest()
+    
+    def generation_key(self, model: str, guidance: str, steps: int) -> str:
+        """Cache key for the video generated from this scene with the given settings"""
+        return hashlib.md5(f"{self.scene}|{model}|{steps}|{guidance}".encode()).hexdigest()
+
+def json_dumps(value: Any) -> str:
+    """JSON encoder for aiohttp request bodies, backed by orjson"""
+    return orjson.dumps(value).decode()
+
+@functools.lru_cache(maxsize=16)
+def queue_body_template(model: str, guidance: str, steps: int) -> bytes:
+    """
+    Pre-encoded queue join body for fixed generation settings
+    
+    The prompt and session hash are filled in with `template % (prompt, hash)`,
+    each already JSON-encoded.
+    """
+    # Escape % in the encoded settings so only the two placeholders remain
+    settings = orjson.dumps([model, guidance, steps])[1:-1].replace(b"%", b"%%")
+    return (
+        b'{"data":[%%s,%s],"event_data":null,"fn_index":1,"trigger_id":10,"session_hash":%%s}'
+        % settings
+    )
+
+# Shared HTTP session for all generators and downloads, created on first use
+_shared_session: Optional[aiohttp.ClientSession] = None
+
+def get_shared_session() -> aiohttp.ClientSession:
+    """Get or create the shared aiohttp session and its connection pool"""
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        _shared_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=64,
+                limit_per_host=16,
+                ttl_dns_cache=300,
+                keepalive_timeout=75
+            ),
+            json_serialize=json_dumps
+        )
+    return _shared_session
+
+async def close_shared_session():
+    """Close the shared aiohttp session (call on application shutdown)"""
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
+async def sse_messages(stream: aiohttp.StreamReader) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parse a Server-Sent Events stream into its JSON messages
+    
+    data: lines are collected until the blank line that ends an event, then
+    joined and decoded; comments and other fields are ignored.
+    """
+    data_lines = []
+    async for raw_line in stream:
+        line = raw_line.rstrip(b"\r\n")
+        
+        if not line:
+            # Blank line: dispatch the buffered event
+            if data_lines:
+                payload = b"\n".join(data_lines)
+                data_lines.clear()
+                try:
+                    yield orjson.loads(payload)
+                except orjson.JSONDecodeError:
+                    continue
+        elif line.startswith(b"data:"):
+            value = line[5:]
+            data_lines.append(value[1:] if value.startswith(b" ") else value)
+    
+    # A final event without its trailing blank line
+    if data_lines:
+        try:
+            yield orjson.loads(b"\n".join(data_lines))
+        except orjson.JSONDecodeError:
+            pass
+
+def is_session_not_found(data: Dict[str, Any]) -> bool:
+    """Check whether an SSE message reports that the queue does not know the session"""
+    return data.get('msg') == 'unexpected_error' and 'session not found' in str(data.get('message', '')).lower()
 
 class VideoGenerationError(Exception):
     """Custom exception for video generation errors"""
     pass
 
+class RateLimitedError(VideoGenerationError):
+    """The queue rejected a join as rate limited or overloaded (429/5xx)"""
+    pass
+
+class SessionNotFoundError(VideoGenerationError):
+    """The result stream was opened before the queue registered the session"""
+    pass
+
 class VideoGenerator:
     """Optimized video generator with async support and better error handling"""
     
-    def __init__(self, config: VideoGenerationConfig):
+    def __init__(self, config: VideoGenerationConfig, limiter: Optional[AsyncLimiter] = None):
         self.config = config
-        self.session_hash = ""
+        # Queue-join budget shared with other generators; replaces local backoff on 429/5xx
+        self.limiter = limiter
         self.headers = {
             'Content-Type': 'application/json',
             'x-zerogpu-uuid': 'fwmmUsBxWJ9SqpiE-V8r5'
         }
-        self._session = None
-    
-    @asynccontextmanager
-    async def get_session(self):
-        """Context manager for aiohttp session"""
-        if self._session is None or self._session.closed:
-            timeout = aiohttp.ClientTimeout(total=self.config.timeout)
-            self._session = aiohttp.ClientSession(
-                headers=self.headers,
-                timeout=timeout
-            )
-        try:
-            yield self._session
-        finally:
-            pass  # Keep session alive for reuse
+        self.timeout = aiohttp.ClientTimeout(total=self.config.timeout)
     
     async def close(self):
-        """Close the aiohttp session"""
-        if self._session and not self._session.closed:
-            await self._session.close()
+        """
+        Release the generator's resources
+        
+        The HTTP session is shared with other pipelines and downloads, so it is
+        left open; close_shared_session() closes it on application shutdown.
+        """
     
     def _generate_session_hash(self) -> str:
         """Generate a random session hash"""
-        return ''.join(random.choices(string.ascii_letters + string.digits, k=13))
+        return secrets.token_urlsafe(10)[:13]
     
     async def generate_single_video(
         self, 
         scene: Scene, 
-        model: str = "epiCRealism", 
-        guidance: str = "", 
-        steps: int = 4
+        model: str = DEFAULT_MODEL, 
+        guidance: str = DEFAULT_GUIDANCE, 
+        steps: int = DEFAULT_STEPS,
+        session_hash: Optional[str] = None
     ) -> str:
         """
         Generate a single video from a scene with retry logic
@@ -103,17 +212,24 @@ class VideoGenerator:
             model: AI model to use
             guidance: Additional guidance for generation
             steps: Number of generation steps
+            session_hash: Queue session already joined with submit(); the first
+                attempt only waits for its result
             
         Returns:
             URL of the generated video
         """
         for attempt in range(self.config.max_retries):
             try:
+                if attempt == 0 and session_hash is not None:
+                    return await self._await_joined(session_hash, scene)
                 return await self._generate_video_attempt(scene, model, guidance, steps)
             except Exception as e:
                 logger.warning(f"Attempt {attempt + 1} failed for scene {scene.sec}: {e}")
                 if attempt < self.config.max_retries - 1:
-                    await asyncio.sleep(self.config.retry_delay * (2 ** attempt))
+                    # A rate-limited join already spent an extra token of the shared
+                    # limiter; the next join waits on it instead of sleeping locally
+                    if self.limiter is None or not isinstance(e, RateLimitedError):
+                        await asyncio.sleep(self.config.retry_delay * (2 ** attempt))
                 else:
                     logger.error(f"All attempts failed for scene {scene.sec}")
                     raise VideoGenerationError(f"Failed to generate video after {self.config.max_retries} attempts: {e}")
@@ -126,68 +242,129 @@ class VideoGenerator:
         steps: int
     ) -> str:
         """Single attempt at video generation"""
-        self.session_hash = self._generate_session_hash()
-        
-        queue_data = {
-            "data": [scene.scene, model, guidance, steps],
-            "event_data": None,
-            "fn_index": 1,
-            "trigger_id": 10,
-            "session_hash": self.session_hash
-        }
+        # Open the result stream while the join is in flight; both are keyed on
+        # the session hash, so the SSE handshake no longer waits for the POST
+        session_hash = self._generate_session_hash()
+        result = asyncio.create_task(self.await_result(session_hash))
+        try:
+            await self.submit(scene, model, guidance, steps, session_hash=session_hash)
+        except BaseException:
+            result.cancel()
+            raise
+        return await self._await_joined(session_hash, scene, result)
+    
+    async def _await_joined(
+        self, 
+        session_hash: str, 
+        scene: Scene, 
+        result: Optional[asyncio.Task] = None
+    ) -> str:
+        """
+        Wait for the result of a session whose queue join succeeded
         
-        async with self.get_session() as session:
-            # Join the queue
-            queue_url = f"{self.config.base_url}/queue/join?__theme=system"
-            async with session.post(queue_url, json=queue_data) as response:
-                if not response.ok:
-                    raise VideoGenerationError(f"Queue join failed: {response.status}")
-                
-                logger.info(f"Video generation queued for scene {scene.sec}: {scene.scene[:50]}...")
-                
-                # Wait for results via SSE (this needs to be synchronous due to sseclient)
-                return await asyncio.get_event_loop().run_in_executor(
-                    None, self._wait_for_video_result
-                )
+        Args:
+            session_hash: Session the scene was joined under
+            scene: Scene being generated, for logging
+            result: Result stream already opened alongside the join, if any
+        """
+        try:
+            return await (result if result is not None else self.await_result(session_hash))
+        except SessionNotFoundError:
+            # The stream connected before the queue registered the session; the job
+            # is queued, so reopen the stream rather than resubmitting it
+            logger.info(f"Reopening result stream for scene {scene.sec}")
+            return await self.await_result(session_hash)
     
-    def _wait_for_video_result(self) -> str:
+    async def submit(
+        self, 
+        scene: Scene, 
+        model: str = DEFAULT_MODEL, 
+        guidance: str = DEFAULT_GUIDANCE, 
+        steps: int = DEFAULT_STEPS,
+        session_hash: Optional[str] = None
+    ) -> str:
+        """
+        Join the generation queue for a scene
+        
+        Args:
+            session_hash: Hash to join under; a new one is generated by default
+        
+        Returns:
+            The session hash to wait on with await_result()
+        """
+        # Kept local: scenes run concurrently on one generator
+        session_hash = session_hash or self._generate_session_hash()
+        
+        # Only the prompt and hash are encoded per scene
+        body = queue_body_template(model, guidance, steps) % (
+            orjson.dumps(scene.scene), orjson.dumps(session_hash)
+        )
+        
+        session = get_shared_session()
+        
+        # Join the queue
+        queue_url = f"{self.config.base_url}/queue/join?__theme=system"
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        async with session.post(
+            queue_url, data=body, headers=self.headers, timeout=self.timeout
+        ) as response:
+            status = response.status
+        
+        if status == 429 or status >= 500:
+            if self.limiter is not None:
+                # Server is overloaded: spend an extra token to slow every generator
+                await self.limiter.acquire()
+            raise RateLimitedError(f"Queue join failed: {status}")
+        if status >= 400:
+            raise VideoGenerationError(f"Queue join failed: {status}")
+        
+        logger.info(f"Video generation queued for scene {scene.sec}: {scene.scene[:50]}...")
+        return session_hash
+    
+    async def await_result(self, session_hash: str) -> str:
         """Wait for video generation result via Server-Sent Events"""
-        sse_url = f"{self.config.base_url}/queue/data?session_hash={self.session_hash}"
+        session = get_shared_session()
+        sse_url = f"{self.config.base_url}/queue/data?session_hash={session_hash}"
         
         try:
-            import requests  # Import here for thread executor
-            response = requests.get(
-                sse_url, 
-                stream=True, 
-                headers={'Accept': 'text/event-stream'},
-                timeout=self.config.timeout
-            )
-            client = sseclient.SSEClient(response)
-            
-            for event in client.events():
-                if event.data:
-                    try:
-                        data = json.loads(event.data)
-                        
-                        if data.get('msg') == 'process_completed':
-                            video_data = data.get('output', {}).get('data', [{}])
-                            if video_data and video_data[0].get('video', {}).get('url'):
-                                video_url = video_data[0]['video']['url']
-                                logger.info("Video generated successfully!")
-                                return video_url
-                            else:
-                                raise VideoGenerationError('Invalid video data received')
-                                
-                        elif data.get('msg') == 'estimation':
-                            if data.get('rank') and data.get('queue_size'):
-                                logger.info(f"Position in queue: {data['rank']} of {data['queue_size']}")
-                                
-                        elif data.get('msg') == 'close_stream':
-                            break
+            async with session.get(
+                sse_url,
+                headers={'Accept': 'text/event-stream', **self.headers},
+                timeout=self.timeout
+            ) as response:
+                if response.status == 404:
+                    raise SessionNotFoundError(f"Session {session_hash} not found")
+                response.raise_for_status()
+                
+                received = False
+                async for data in sse_messages(response.content):
+                    if is_session_not_found(data):
+                        raise SessionNotFoundError(f"Session {session_hash} not found")
+                    received = True
+                    
+                    if data.get('msg') == 'process_completed':
+                        video_data = data.get('output', {}).get('data', [{}])
+                        if video_data and video_data[0].get('video', {}).get('url'):
+                            video_url = video_data[0]['video']['url']
+                            logger.info("Video generated successfully!")
+                            return video_url
+                        else:
+                            raise VideoGenerationError('Invalid video data received')
+                            
+                    elif data.get('msg') == 'estimation':
+                        if data.get('rank') and data.get('queue_size'):
+                            logger.info(f"Position in queue: {data['rank']} of {data['queue_size']}")
                             
-                    except json.JSONDecodeError:
-                        continue
+                    elif data.get('msg') == 'close_stream':
+                        break
+                
+                if not received:
+                    # Ended without a single message: the session was not registered yet
+                    raise SessionNotFoundError(f"Stream for session {session_hash} ended empty")
                         
+        except VideoGenerationError:
+            raise
         except Exception as e:
             raise VideoGenerationError(f"SSE Error: {str(e)}")
             
@@ -199,17 +376,37 @@ class VideoStitcher:
     def __init__(self, config: VideoGenerationConfig):
         self.config = config
     
-    async def download_video(self, url: str, temp_path: str) -> str:
-        """Download video asynchronously"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                response.raise_for_status()
-                
-                with open(temp_path, 'wb') as f:
-                    async for chunk in response.content.iter_chunked(1024 * 1024):
-                        f.write(chunk)
-                
-                return temp_path
+    async def download_video(self, session: aiohttp.ClientSession, url: str, temp_path: str) -> str:
+        """Download video asynchronously, writing it without blocking the event loop"""
+        # A read buffer as large as the write chunk lets each wakeup drain more of
+        # the socket, instead of the 64 KiB aiohttp reads by default
+        async with session.get(url, read_bufsize=DOWNLOAD_CHUNK_SIZE) as response:
+            response.raise_for_status()
+            
+            async with aiofiles.open(temp_path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+            
+            return temp_path
+    
+    def start_download(self, scene: Scene) -> Tuple[str, asyncio.Task]:
+        """
+        Start downloading a scene's video in the background
+        
+        Returns:
+            The temp file path and the download task
+        """
+        # Unique names; concurrent requests in the same second no longer collide
+        temp_file = os.path.join(self.config.temp_dir, f"{uuid.uuid4().hex}.mp4")
+        task = asyncio.create_task(self.download_video(get_shared_session(), scene.url, temp_file))
+        return temp_file, task
+    
+    async def discard_downloads(self, downloads: List[Tuple[str, asyncio.Task]]):
+        """Cancel started downloads and remove their temp files"""
+        for _, task in downloads:
+            task.cancel()
+        await asyncio.gather(*[task for _, task in downloads], return_exceptions=True)
+        await self._cleanup_temp_files([temp_file for temp_file, _ in downloads])
     
     async def stitch_videos(self, scenes: List[Scene], output_path: str = "final_video.mp4") -> Dict[str, Any]:
         """
@@ -225,31 +422,41 @@ class VideoStitcher:
         if not scenes:
             raise ValueError("No scenes provided for stitching")
         
+        # Download all videos concurrently over the shared connection pool
+        downloads = []
+        for scene in scenes:
+            if not scene.url:
+                logger.warning(f"No URL for scene {scene.sec}, skipping")
+                continue
+            downloads.append(self.start_download(scene))
+        
+        if not downloads:
+            raise ValueError("No valid video URLs to download")
+        
+        return await self.stitch_downloads(downloads, output_path)
+    
+    async def stitch_downloads(
+        self, 
+        downloads: List[Tuple[str, asyncio.Task]], 
+        output_path: str = "final_video.mp4"
+    ) -> Dict[str, Any]:
+        """
+        Stitches videos whose downloads were started with start_download()
+        
+        Args:
+            downloads: Temp file paths and download tasks, in playback order
+            output_path: Path to save the final stitched video
+            
+        Returns:
+            Dictionary with success status, path and the number of clips joined
+        """
         clips = []
-        temp_files = []
+        temp_files = [temp_file for temp_file, _ in downloads]
         
         try:
-            # Download all videos concurrently
-            download_tasks = []
-            
-            for i, scene in enumerate(scenes):
-                if not scene.url:
-                    logger.warning(f"No URL for scene {scene.sec}, skipping")
-                    continue
-                
-                temp_file = os.path.join(
-                    self.config.temp_dir, 
-                    f"temp_video_{i}_{int(time.time())}.mp4"
-                )
-                temp_files.append(temp_file)
-                download_tasks.append(self.download_video(scene.url, temp_file))
-            
-            if not download_tasks:
-                raise ValueError("No valid video URLs to download")
-            
             # Wait for all downloads to complete
-            logger.info(f"Downloading {len(download_tasks)} videos...")
-            downloaded_files = await asyncio.gather(*download_tasks, return_exceptions=True)
+            logger.info(f"Downloading {len(downloads)} videos...")
+            downloaded_files = await asyncio.gather(*[task for _, task in downloads], return_exceptions=True)
             
             # Filter out failed downloads
             valid_files = [f for f in downloaded_files if isinstance(f, str) and os.path.exists(f)]
@@ -259,25 +466,40 @@ class VideoStitcher:
             
             logger.info(f"Successfully downloaded {len(valid_files)} videos")
             
-            # Create video clips in a thread executor to avoid blocking
-            def create_clips():
-                clips_list = []
-                for file_path in valid_files:
-                    try:
-                        clip = VideoFileClip(file_path)
-                        clips_list.append(clip)
-                    except Exception as e:
-                        logger.error(f"Failed to create clip from {file_path}: {e}")
-                return clips_list
+            # A single clip needs no stitching; move it into place
+            if len(valid_files) == 1:
+                await asyncio.to_thread(shutil.move, valid_files[0], output_path)
+                return {"success": True, "path": output_path, "clips": len(valid_files)}
+            
+            # Clips from the same model share codecs and size; join them without re-encoding
+            if await streams_compatible(valid_files):
+                try:
+                    logger.info("Joining videos with ffmpeg stream copy...")
+                    await concat_copy(valid_files, output_path)
+                    return {"success": True, "path": output_path, "clips": len(valid_files)}
+                except RuntimeError as e:
+                    logger.warning(f"ffmpeg concat failed, re-encoding with MoviePy: {e}")
+            
+            # Open the clips concurrently; each VideoFileClip waits on its own ffmpeg probe
+            async def open_clip(file_path: str) -> Optional[VideoFileClip]:
+                try:
+                    return await asyncio.to_thread(VideoFileClip, file_path)
+                except Exception as e:
+                    logger.error(f"Failed to create clip from {file_path}: {e}")
+                    return None
             
-            clips = await asyncio.get_event_loop().run_in_executor(None, create_clips)
+            opened = await asyncio.gather(*[open_clip(file_path) for file_path in valid_files])
+            clips = [clip for clip in opened if clip is not None]
             
             if not clips:
                 raise ValueError("No valid video clips created")
             
             # Stitch videos in thread executor
             def stitch():
-                final_clip = concatenate_videoclips(clips, method="compose")
+                # compose is only needed to pad clips of different sizes onto one canvas
+                first = clips[0]
+                same_shape = all(c.size == first.size and c.fps == first.fps for c in clips)
+                final_clip = concatenate_videoclips(clips, method="chain" if same_shape else "compose")
                 
                 # Suppress MoviePy output by redirecting stdout/stderr
                 with open(os.devnull, 'w') as devnull:
@@ -304,7 +526,7 @@ class VideoStitcher:
             logger.info("Stitching videos...")
             final_path = await asyncio.get_event_loop().run_in_executor(None, stitch)
             
-            return {"success": True, "path": final_path}
+            return {"success": True, "path": final_path, "clips": len(clips)}
             
         except Exception as e:
             logger.error(f"Error stitching videos: {e}")
@@ -321,63 +543,202 @@ class VideoStitcher:
             await self._cleanup_temp_files(temp_files)
     
     async def _cleanup_temp_files(self, temp_files: List[str]):
-        """Clean up temporary files with proper error handling"""
-        for file_path in temp_files:
+        """Clean up temporary files concurrently with proper error handling"""
+        async def remove(file_path: str):
             try:
-                if os.path.exists(file_path):
-                    await asyncio.sleep(0.1)  # Small delay before deletion
-                    os.remove(file_path)
-            except Exception as e:
-                logger.warning(f"Could not delete temp file {file_path}: {e}")
+                await aiofiles.os.remove(file_path)
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                if sys.platform != "win32":
+                    raise
+                # Windows can hold the handle of a just-closed clip for a moment
+                await asyncio.sleep(0.05)
+                await aiofiles.os.remove(file_path)
+        
+        paths = [file_path for file_path in temp_files if os.path.exists(file_path)]
+        results = await asyncio.gather(*[remove(file_path) for file_path in paths], return_exceptions=True)
+        for file_path, result in zip(paths, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not delete temp file {file_path}: {result}")
 
 class VideoProcessingPipeline:
     """Main pipeline for video generation and processing"""
     
     def __init__(self, config: Optional[VideoGenerationConfig] = None):
         self.config = config or VideoGenerationConfig()
-        self.generator = VideoGenerator(self.config)
+        # Shared by every queue join so retries are spread out rather than synchronized
+        self.limiter = AsyncLimiter(max_rate=self.config.join_rate, time_period=1.0)
+        self.generator = VideoGenerator(self.config, self.limiter)
         self.stitcher = VideoStitcher(self.config)
+        # Scene prompt -> generated URL, and scene set -> stitched video path
+        self.cache = diskcache.Cache(self.config.cache_dir) if self.config.cache_dir else None
+        self.semantic = self._create_semantic_cache()
     
-    async def process_scenes(self, scenes_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def _create_semantic_cache(self) -> Optional[SemanticCache]:
+        """Create the near-duplicate prompt cache when enabled and its dependencies exist"""
+        if not self.config.semantic_cache:
+            return None
+        if not semantic_cache_available():
+            logger.warning("Semantic cache disabled: sentence-transformers/faiss not installed")
+            return None
+        path = os.path.join(self.config.cache_dir, "semantic.pkl") if self.config.cache_dir else None
+        return SemanticCache(threshold=self.config.semantic_threshold, path=path)
+    
+    @staticmethod
+    async def _url_alive(url: str) -> bool:
+        """Check that the server still serves a generated video"""
+        try:
+            async with get_shared_session().head(
+                url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=10)
+            ) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+    
+    async def _cached_url(self, key: str) -> Optional[str]:
+        """Return a cached video URL if the server still serves it"""
+        if self.cache is None:
+            return None
+        url = self.cache.get(key)
+        if url is None:
+            return None
+        if await self._url_alive(url):
+            return url
+        
+        # Generated files expire on the server; forget the stale URL
+        self.cache.delete(key)
+        return None
+    
+    def _remember_similar(self, scenes: List[Scene]) -> None:
+        """Add newly generated scenes to the semantic cache and persist it"""
+        self.semantic.add_many([s.scene for s in scenes], [s.url for s in scenes])
+        self.semantic.save()
+    
+    @staticmethod
+    def _stitched_key(scenes: List[Scene]) -> str:
+        """Cache key for the stitched video of an ordered scene set"""
+        return "stitched:" + hashlib.md5("|".join(s.cache_key for s in scenes).encode()).hexdigest()
+    
+    @staticmethod
+    def _publish_cached(cached_path: str, output_path: str) -> None:
         """
-        Process a list of scenes and return video URLs
+        Place a reused stitched video at output_path with a fresh modification time
+        
+        The stitched cache outlives callers' own freshness checks on output_path
+        (such as the topic TTL in main.py); touching the file keeps a reused video
+        from being rejected as stale on every later request.
+        """
+        if os.path.abspath(cached_path) != os.path.abspath(output_path):
+            root, ext = os.path.splitext(output_path)
+            partial_path = f"{root}.{uuid.uuid4().hex}.partial{ext}"
+            try:
+                os.link(cached_path, partial_path)
+            except OSError:
+                shutil.copyfile(cached_path, partial_path)
+            os.replace(partial_path, output_path)
+        os.utime(output_path)
+    
+    async def stream_scenes(self, scenes_data: List[Dict[str, Any]]) -> AsyncIterator[Scene]:
+        """
+        Generate videos for a list of scenes, yielding each scene as its URL is ready
+        
+        Scenes come out in completion order, not by second; scenes that failed to
+        generate are not yielded.
         
         Args:
             scenes_data: List of scene dictionaries
             
-        Returns:
-            Dictionary with processed scenes
+        Yields:
+            Scene objects with their video URL set
         """
         scenes = [Scene(**scene_data) for scene_data in scenes_data]
         
         # Generate videos concurrently with limited concurrency
         semaphore = asyncio.Semaphore(self.config.max_workers)
+        generated = []
+        
+        # Embed every prompt in one batch and find near-duplicates of earlier scenes
+        similar_urls = [None] * len(scenes)
+        if self.semantic:
+            similar_urls = await asyncio.to_thread(
+                self.semantic.lookup_many, [scene.scene for scene in scenes]
+            )
+        
+        async def reuse_cached(scene: Scene, similar_url: Optional[str]) -> bool:
+            key = scene.generation_key(DEFAULT_MODEL, DEFAULT_GUIDANCE, DEFAULT_STEPS)
+            cached_url = await self._cached_url(key)
+            if cached_url:
+                logger.info(f"Reusing cached video for scene {scene.sec}")
+                scene.url = cached_url
+                return True
+            if similar_url and await self._url_alive(similar_url):
+                logger.info(f"Reusing video of a similar prompt for scene {scene.sec}")
+                scene.url = similar_url
+                return True
+            return False
+        
+        reused = await asyncio.gather(
+            *[reuse_cached(scene, url) for scene, url in zip(scenes, similar_urls)]
+        )
+        for scene, hit in zip(scenes, reused):
+            if hit:
+                yield scene
+        pending = [scene for scene, hit in zip(scenes, reused) if not hit]
         
         async def generate_with_semaphore(scene: Scene) -> Scene:
+            key = scene.generation_key(DEFAULT_MODEL, DEFAULT_GUIDANCE, DEFAULT_STEPS)
+            # Every scene joins the queue at once; the joins are cheap, so only
+            # the long result waits are bounded by max_workers
+            try:
+                session_hash = await self.generator.submit(scene)
+            except Exception as e:
+                # A failed join falls back to a full attempt
+                logger.warning(f"Queue join failed for scene {scene.sec}: {e}")
+                session_hash = None
             async with semaphore:
                 try:
-                    scene.url = await self.generator.generate_single_video(scene)
+                    scene.url = await self.generator.generate_single_video(
+                        scene, session_hash=session_hash
+                    )
                     logger.info(f"Generated video for scene {scene.sec}")
+                    if self.cache is not None:
+                        self.cache.set(key, scene.url, expire=self.config.cache_ttl)
+                    generated.append(scene)
                 except Exception as e:
                     logger.error(f"Failed to generate video for scene {scene.sec}: {e}")
                     scene.url = None
                 return scene
         
-        logger.info(f"Starting generation for {len(scenes)} scenes with {self.config.max_workers} workers...")
+        logger.info(f"Starting generation for {len(pending)} scenes with {self.config.max_workers} workers...")
         
-        # Process scenes concurrently
-        processed_scenes = await asyncio.gather(
-            *[generate_with_semaphore(scene) for scene in scenes],
-            return_exceptions=True
-        )
+        tasks = [asyncio.create_task(generate_with_semaphore(scene)) for scene in pending]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                scene = await next_done
+                if scene.url:
+                    yield scene
+        finally:
+            # The consumer stopped early or failed; don't leave generations running
+            for task in tasks:
+                task.cancel()
         
-        # Filter successful results
-        successful_scenes = [
-            scene for scene in processed_scenes 
-            if isinstance(scene, Scene) and scene.url
-        ]
+        if self.semantic and generated:
+            await asyncio.to_thread(self._remember_similar, generated)
+    
+    async def process_scenes(self, scenes_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Process a list of scenes and return video URLs
         
-        logger.info(f"Successfully generated {len(successful_scenes)}/{len(scenes)} videos")
+        Args:
+            scenes_data: List of scene dictionaries
+            
+        Returns:
+            Dictionary with processed scenes
+        """
+        successful_scenes = [scene async for scene in self.stream_scenes(scenes_data)]
+        
+        logger.info(f"Successfully generated {len(successful_scenes)}/{len(scenes_data)} videos")
         
         # Sort by second
         successful_scenes.sort(key=lambda x: x.sec)
@@ -410,34 +771,62 @@ class VideoProcessingPipeline:
             Result dictionary with success status and path
         """
         try:
-            # Generate videos
-            result = await self.process_scenes(scenes_data)
+            # Reuse the stitched video of an identical scene set
+            stitched_key = self._stitched_key([Scene(**item) for item in scenes_data])
+            cached_path = self.cache.get(stitched_key) if self.cache is not None else None
+            if cached_path and os.path.exists(cached_path):
+                logger.info(f"Reusing stitched video {cached_path}")
+                await asyncio.to_thread(self._publish_cached, cached_path, output_path)
+                return {"success": True, "path": output_path, "complete": True}
+            
+            # Start downloading each video as soon as it is generated, so only the
+            # final join waits on the slowest scene
+            downloads = []
+            try:
+                async for scene in self.stream_scenes(scenes_data):
+                    downloads.append((scene.sec, self.stitcher.start_download(scene)))
+            except BaseException:
+                await self.stitcher.discard_downloads([download for _, download in downloads])
+                raise
             
-            if not result["response"]:
+            if not downloads:
                 return {"success": False, "error": "No videos were generated successfully"}
             
-            # Create scenes from result
-            scenes = [
-                Scene(
-                    sec=item["sec"],
-                    scene=item["scene"], 
-                    dialog=item["dialog"],
-                    url=item["url"]
+            logger.info(f"Successfully generated {len(downloads)}/{len(scenes_data)} videos")
+            
+            # Stitch videos in scene order next to the output, and move the file into
+            # place only once it is complete, so a failed or interrupted stitch never
+            # leaves a truncated video at output_path
+            downloads.sort(key=lambda item: item[0])
+            root, ext = os.path.splitext(output_path)
+            run_id = uuid.uuid4().hex
+            partial_path = f"{root}.{run_id}.partial{ext}"
+            try:
+                stitch_result = await self.stitcher.stitch_downloads(
+                    [download for _, download in downloads], partial_path
                 )
-                for item in result["response"]
-            ]
+                # A video missing scenes is still returned, but kept under a
+                # one-off name so it is never reused for later requests
+                complete = len(downloads) == len(scenes_data) and stitch_result.get("clips") == len(downloads)
+                stitch_result["complete"] = complete
+                if stitch_result.get("success"):
+                    final_path = output_path if complete else f"{root}.{run_id}{ext}"
+                    os.replace(partial_path, final_path)
+                    stitch_result["path"] = final_path
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
             
-            # Stitch videos
-            stitch_result = await self.stitcher.stitch_videos(scenes, output_path)
+            if self.cache is not None and stitch_result.get("success") and complete:
+                self.cache.set(
+                    stitched_key, os.path.abspath(stitch_result["path"]), expire=self.config.cache_ttl
+                )
             
             return stitch_result
             
         except Exception as e:
             logger.error(f"Pipeline error: {e}")
             return {"success": False, "error": str(e)}
-        
-        finally:
-            await self.generator.close()
 
 # Optimized FastAPI endpoint
 async def generate_video_endpoint(topic: str, duration: Optional[int] = 30):
@@ -521,5 +910,6 @@ if __name__ == "__main__":
         )
         
         print("Result:", result)
+        await close_shared_session()
     
     asyncio.run(main())
\ No newline at end of file